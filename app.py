@@ -1,14 +1,38 @@
-from flask import Flask, jsonify, render_template, request
-from nyct_refs import (NYCTFeed, NYCTStaticData)
-from lirr_refs import ( LIRRFeed, LIRRStaticData)
+import math
+import os
+from flask import Flask, Response, jsonify, render_template, request
+from nyct_refs import (NYCTFeed, NYCTStaticData, PARTITIONS as NYCT_PARTITIONS, SNAPSHOT_LISTENERS as NYCT_SNAPSHOT_LISTENERS,
+                       TRIP_TYPES, start_refresher)
+from lirr_refs import ( LIRRFeed, LIRRStaticData, LIRRScheduledService, get_station_name as get_lirr_station_name)
 from datetime import datetime
 from updater import run_updates
+from serializers import SnapshotCache, negotiate
+from headways import compute_headways
+from stop_index import StopIndex, join_arrivals
+from stop_search import StopSearch
+from subscriptions import SubscriptionRegistry, WebhookDelivery, start_poller
+from segment_times import SegmentEstimator
 
-run_updates()
+# Set MTA_SKIP_UPDATES to start offline with whatever is already in data/
+if not os.environ.get("MTA_SKIP_UPDATES"):
+    run_updates()
 
 app = Flask(__name__)
 LIRR_STATIC = LIRRStaticData()
 NYCT_STATIC = NYCTStaticData()
+LIRR_SCHEDULE = LIRRScheduledService()
+STOP_INDEX = StopIndex.from_static()
+STOP_SEARCH = StopSearch.from_static()
+SNAPSHOTS = SnapshotCache()
+SUBSCRIPTIONS = SubscriptionRegistry()
+SEGMENTS = SegmentEstimator()
+POLLER = None
+TRIP_TYPE_NAMES = set(TRIP_TYPES.values()) | {"unknown"}
+
+# Learn segment run times from every decoded sub-feed snapshot, refreshed in the
+# background so the estimator keeps learning while nobody is asking for ETAs
+NYCT_SNAPSHOT_LISTENERS.append(lambda snapshot: SEGMENTS.update(snapshot.trips, snapshot.timestamp))
+REFRESHER = start_refresher()
 
 def fmt_time(ts):
     if not ts:
@@ -17,7 +41,16 @@ def fmt_time(ts):
         return datetime.fromtimestamp(ts).strftime("%H:%M:%S")
     except Exception:
         return str(ts)
-    
+
+# Serve the rows for a feed snapshot in the format the client asked for
+def respond(system, view, timestamps, build_rows):
+    mimetype = negotiate(request)
+    body = SNAPSHOTS.encode(system, view, timestamps, mimetype, build_rows)
+    resp = Response(body, mimetype=mimetype)
+    # The body depends on Accept, keep shared caches from mixing formats up
+    resp.vary.add("Accept")
+    return resp
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -27,12 +60,25 @@ def index():
 def api_nyct_trains():
     # Fetch the line from query parameters, default to "A"
     line = request.args.get("line", "A").upper()
+    # Optional filters on the decoded train_id, e.g. trip_type=reroute or destination=SFT
+    filters = {key: request.args.get(key, "") for key in ("trip_type", "origin", "destination")}
+    filters["trip_type"] = filters["trip_type"].lower()
+    if filters["trip_type"] and filters["trip_type"] not in TRIP_TYPE_NAMES:
+        return jsonify({"error": "trip_type must be one of " + ", ".join(sorted(TRIP_TYPE_NAMES))}), 400
     feed = NYCTFeed(line)
     if feed is None:
         return
-    
+    key = (line,) + tuple(filters.values())
+    # Rows are built and sorted per sub-feed snapshot, so only sub-feeds that changed are rebuilt
+    return respond("nyct", key, feed.timestamps, lambda: feed.merged_rows(
+        key, lambda snapshot: build_nyct_rows(snapshot, line, snapshot.filter_trips(**filters)), nyct_row_order))
+
+def nyct_row_order(row):
+    return row.get("route_id", "")
+
+def build_nyct_rows(feed, line, trips=None):
     train_list = []
-    for trip in feed.trips:
+    for trip in feed.trips if trips is None else trips:
         # Only filter by line if not "ALL"
         if line != "ALL" and hasattr(trip.trip, "route_id") and trip.trip.route_id.upper() != line:
             continue
@@ -72,9 +118,41 @@ def api_nyct_trains():
             })
 
     # Sort by route_id alphabetically
-    train_list.sort(key=lambda x: x.get("route_id", ""))
+    train_list.sort(key=nyct_row_order)
+    return train_list
+
+@app.route("/api/nyct/headways")
+def api_nyct_headways():
+    line = request.args.get("line", "A").upper()
+    feed = NYCTFeed(line)
+    if feed is None:
+        return
+    return jsonify(compute_headways(feed.trips, line))
+
+# MTA predictions next to ones corrected with learned segment run times
+@app.route("/api/nyct/etas")
+def api_nyct_etas():
+    line = request.args.get("line", "A").upper()
+    feed = NYCTFeed(line)
+    if feed is None:
+        return
+    train_list = []
+    for trip in feed.trips:
+        if line != "ALL" and trip.trip.route_id.upper() != line:
+            continue
+        train_list.append({
+            "route_id": trip.trip.route_id,
+            "trip_id": trip.id,
+            "direction": getattr(trip, "direction", ""),
+            "stops": SEGMENTS.corrected_etas(trip),
+        })
     return jsonify(train_list)
 
+# Freshness of each NYCT sub-feed in the shared view
+@app.route("/api/nyct/feeds")
+def api_nyct_feeds():
+    return jsonify([partition.freshness() for partition in NYCT_PARTITIONS])
+
 # --- LIRR Endpoints ---
 @app.route("/api/lirr/trains")
 def api_lirr_trains():
@@ -82,7 +160,12 @@ def api_lirr_trains():
     feed = LIRRFeed(line)
     if feed is None:
         return 
+    # Fall back to the timetable when realtime data is missing or stale, never cached
+    if feed.is_stale():
+        return respond("lirr", ("scheduled", line), [], lambda: build_lirr_scheduled_rows(line))
+    return respond("lirr", line, feed.timestamps, lambda: build_lirr_rows(feed, line))
 
+def build_lirr_rows(feed, line):
     train_list = []
     for trip in feed.trips:
         if line != "ALL" and hasattr(trip.trip, "route_id") and trip.trip.route_id.upper() != line:
@@ -105,7 +188,128 @@ def api_lirr_trains():
                 "route_text_color": color_info["text_color"],
                 "trip_id": trip.id,
             })
-    return jsonify(train_list)
+    return train_list
+
+def build_lirr_scheduled_rows(line, minutes=60):
+    train_list = []
+    for trip_id, route_id, stops in LIRR_SCHEDULE.active_trips(minutes):
+        if line != "ALL" and route_id.upper() != line:
+            continue
+        color_info = LIRR_STATIC.get_colors(route_id)
+        train_list.append({
+            "route_name": LIRR_STATIC.get_headsign(route_id),
+            "route_color": color_info["color"],
+            "route_text_color": color_info["text_color"],
+            "trip_id": trip_id,
+            "scheduled_only": True,
+            "stu": [{
+                "stop_sequence": seq,
+                "stop_id": stop_id,
+                "stop_name": get_lirr_station_name(stop_id),
+                "arrival": arrival,
+                "adelay": 0,
+                "ddelay": 0,
+                "departure": departure,
+                "schedule_relationship": 0,
+                "scheduled": LIRR_STATIC.get_schedule(trip_id, seq),
+                "track": "",
+                "train_status": "",
+            } for seq, stop_id, arrival, departure in stops],
+        })
+    return train_list
+
+@app.route("/api/lirr/departures")
+def api_lirr_departures():
+    stop_id = request.args.get("stop", "")
+    try:
+        minutes = min(int(request.args.get("minutes", 60)), 24 * 60)
+    except ValueError:
+        return jsonify({"error": "minutes must be an integer"}), 400
+    return jsonify(LIRR_SCHEDULE.departures(stop_id, minutes))
+
+# --- Stops ---
+@app.route("/api/stops/nearby")
+def api_stops_nearby():
+    try:
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+        k = min(int(request.args.get("k", 5)), 50)
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat and lon are required, k must be an integer"}), 400
+    if k < 1:
+        return jsonify({"error": "k must be at least 1"}), 400
+    if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({"error": "lat must be within -90..90 and lon within -180..180"}), 400
+
+    results = STOP_INDEX.nearby(lat, lon, k)
+    if request.args.get("arrivals", "").lower() in ("1", "true", "yes"):
+        agencies = {r["agency"] for r in results}
+        trips = {}
+        if "nyct" in agencies:
+            trips["nyct"] = NYCTFeed("ALL").trips
+        if "lirr" in agencies:
+            trips["lirr"] = LIRRFeed("ALL").trips
+        join_arrivals(results, trips)
+    return jsonify(results)
+
+@app.route("/api/stops/search")
+def api_stops_search():
+    query = request.args.get("q", "")
+    try:
+        limit = min(int(request.args.get("limit", 10)), 50)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1"}), 400
+    return jsonify(list(STOP_SEARCH.search(query, limit)))
+
+# --- Subscriptions ---
+@app.route("/api/subscriptions", methods=["POST"])
+def api_subscribe():
+    global POLLER
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "body must be a JSON object"}), 400
+    system = body.get("system", "nyct")
+    if not isinstance(system, str):
+        return jsonify({"error": "system must be a string"}), 400
+    try:
+        minutes = body.get("minutes")
+        sub = SUBSCRIPTIONS.subscribe(
+            body.get("kind", ""),
+            system.lower(),
+            trip_id=body.get("trip_id"),
+            stop_id=body.get("stop_id"),
+            route_id=body.get("route_id"),
+            minutes=float(minutes) if minutes is not None else None,
+            delivery=WebhookDelivery(body["webhook"]) if body.get("webhook") else None,
+        )
+    except (TypeError, ValueError, OverflowError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Start matching snapshots once somebody is listening
+    if POLLER is None:
+        POLLER = start_poller(SUBSCRIPTIONS, {
+            "nyct": lambda: NYCTFeed("ALL").trips,
+            "lirr": lambda: LIRRFeed("ALL").trips,
+        })
+    return jsonify(sub.to_dict()), 201
+
+@app.route("/api/subscriptions/<int:sub_id>", methods=["DELETE"])
+def api_unsubscribe(sub_id):
+    if not SUBSCRIPTIONS.unsubscribe(sub_id):
+        return jsonify({"error": "Unknown subscription"}), 404
+    return "", 204
+
+# Drains the local notification queue, stand-in for a push service
+@app.route("/api/notifications")
+def api_notifications():
+    events = []
+    while len(events) < 1000 and not SUBSCRIPTIONS.delivery.queue.empty():
+        events.append(SUBSCRIPTIONS.delivery.queue.get())
+    return jsonify(events)
 
 if __name__ == "__main__":
     app.run(debug=False)
\ No newline at end of file
@@ -0,0 +1,67 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import time
+from types import SimpleNamespace
+from segment_times import SegmentEstimator
+
+'''
+Replay synthetic days of NYCT snapshots (every 30s, a new trip per route every
+minute) through SegmentEstimator and report throughput, tracked keys and the
+size of the learned statistics.
+
+    python bench/segment_replay.py [days]
+'''
+ROUTES = ["1", "2", "3", "A", "C", "E", "N", "Q", "R", "W"]
+STOPS = 30
+INTERVAL = 30
+START = 1748390400
+
+def run_time(route, s):
+    # Same segment always takes roughly the same time, with some noise
+    return 90 + (hash((route, s)) % 60) + random.randint(-10, 25)
+
+def make_trip(n):
+    route = ROUTES[n % len(ROUTES)]
+    t = START + (n // len(ROUTES)) * 60
+    stus = []
+    for s in range(STOPS):
+        t += run_time(route, s)
+        stus.append(SimpleNamespace(stop_id="%s%02dN" % (route, s), stop_name="", arrival=t - 20, departure=t))
+    return SimpleNamespace(id="trip_%d" % n, trip=SimpleNamespace(route_id=route), direction="NORTH",
+                           stops=stus, next=0, stop_time_updates=stus)
+
+def replay(days=1):
+    random.seed(1)
+    estimator = SegmentEstimator()
+    snapshots = days * 86400 // INTERVAL
+    observed = 0
+    elapsed = 0
+    underway = {}
+    created = 0
+    for k in range(snapshots):
+        now = START + k * INTERVAL
+        # A trip shows up in the feed 10 minutes before it starts
+        while START + (created // len(ROUTES)) * 60 <= now + 600:
+            underway[created] = make_trip(created)
+            created += 1
+        for n, trip in list(underway.items()):
+            while trip.next < STOPS and trip.stops[trip.next].departure < now:
+                trip.next += 1
+            if trip.next == STOPS:
+                del underway[n]
+            else:
+                trip.stop_time_updates = trip.stops[trip.next:]
+        t = time.perf_counter()
+        observed += estimator.update(underway.values(), now)
+        elapsed += time.perf_counter() - t
+    size = sum(sys.getsizeof(s) + sys.getsizeof(s.quantiles) for s in estimator.segments.values())
+    print(f"{snapshots} snapshots in {elapsed:.1f}s ({elapsed / snapshots * 1000:.2f} ms each), "
+          f"{observed} segment observations, {len(estimator.segments)} segments (~{size / 1e3:.0f} kB of stats), "
+          f"{len(estimator.trips)} trips tracked")
+    return estimator
+
+if __name__ == "__main__":
+    replay(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
@@ -0,0 +1,93 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import timeit
+from flask import Flask, jsonify
+from serializers import encode_msgpack, encode_protobuf, decode_protobuf
+
+'''
+Encode size and time of the /api/*/trains payloads: jsonify vs MessagePack vs
+the compact protobuf schema. Rows are synthetic but shaped like the real ones,
+sized like a busy NYCT "ALL" snapshot and a full LIRR snapshot.
+
+    python bench/serialization.py
+'''
+random.seed(1)
+ROUTES = ["1", "2", "3", "4", "5", "6", "7", "A", "C", "E", "B", "D", "F", "M", "G", "J", "Z", "L", "N", "Q", "R", "W"]
+STOPS = ["%d%02d" % (n, i) for n in range(1, 8) for i in range(1, 40)]
+
+def nyct_rows(count=600):
+    rows = []
+    for i in range(count):
+        route = random.choice(ROUTES)
+        stop = random.choice(STOPS)
+        t = 40000 + random.randint(0, 3600)
+        rows.append({
+            "route_id": route,
+            "route_color": "#EE352E",
+            "route_text_color": "#FFFFFF",
+            "trip_name": "Van Cortlandt Park-242 St",
+            "trip_id": "%06d_%s..N03R" % (t, route),
+            "train_id": "0%s %04d+ 242/SFT" % (route, t // 60),
+            "direction": random.choice(["NORTH", "SOUTH"]),
+            "next_stop": stop + random.choice("NS"),
+            "next_stop_name": "Station " + stop,
+            "departure": "%02d:%02d:%02d" % (t // 3600, t // 60 % 60, t % 60),
+            "arrival": "%02d:%02d:%02d" % (t // 3600, t // 60 % 60, t % 60),
+            "actual_track": random.choice(["", "1", "2", "3", "4"]),
+            "is_assigned": random.random() < 0.8,
+        })
+    return rows
+
+def lirr_rows(count=150, stops=12):
+    rows = []
+    for i in range(count):
+        t = 1748385720 + random.randint(0, 7200)
+        stu = []
+        for seq in range(1, stops + 1):
+            stop = str(random.randint(1, 230))
+            stu.append({
+                "stop_sequence": seq,
+                "stop_id": stop,
+                "stop_name": "Station " + stop,
+                "arrival": t + seq * 300,
+                "adelay": random.choice([0, 0, 60, 120]),
+                "ddelay": 0,
+                "departure": t + seq * 300,
+                "schedule_relationship": 0,
+                "scheduled": "%02d:%02d:00" % (seq, seq),
+                "track": random.choice(["", "1", "2", "A"]),
+                "train_status": random.choice(["", "On Time", "Late"]),
+            })
+        rows.append({
+            "route_name": "Babylon Branch",
+            "route_color": "#00985F",
+            "route_text_color": "#FFFFFF",
+            "trip_id": "GO101_25_%d" % i,
+            "stu": stu,
+        })
+    return rows
+
+def bench(system, rows, number=50):
+    app = Flask(__name__)
+    with app.app_context():
+        encoders = {
+            "jsonify": lambda: jsonify(rows).get_data(),
+            "msgpack": lambda: encode_msgpack(system, rows),
+            "protobuf": lambda: encode_protobuf(system, rows),
+        }
+        print(f"{system}: {len(rows)} rows")
+        base = None
+        for name, encode in encoders.items():
+            size = len(encode())
+            ms = timeit.timeit(encode, number=number) / number * 1000
+            base = base or (size, ms)
+            print(f"  {name:<9} {size:>9} bytes ({size / base[0]:5.2f}x)  {ms:8.3f} ms ({ms / base[1]:5.2f}x)")
+
+    assert decode_protobuf(encode_protobuf(system, rows))[2] == rows
+
+if __name__ == "__main__":
+    bench("nyct", nyct_rows())
+    bench("lirr", lirr_rows())
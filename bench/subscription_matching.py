@@ -0,0 +1,64 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import time
+from types import SimpleNamespace
+from subscriptions import SubscriptionRegistry
+
+'''
+Snapshot matching cost with 1k vs 100k subscriptions. Each snapshot moves the
+clock 30s and re-predicts 10% of the trips, matching cost should follow the
+changed trips and the notifications sent, not the number of subscribers.
+
+    python bench/subscription_matching.py
+'''
+ROUTES = ["1", "2", "3", "A", "C", "E", "N", "Q", "R", "W"]
+TRIPS = 500
+STOPS = 20
+START = 1748390400
+
+def make_trip(i, now):
+    route = ROUTES[i % len(ROUTES)]
+    offset = (i // len(ROUTES)) * 240 - 3600
+    stus = []
+    for s in range(STOPS):
+        t = START + offset + s * 120
+        if t < now:
+            continue
+        stus.append(SimpleNamespace(stop_id="%s%02dN" % (route, s), arrival=t, departure=t + 30,
+                                    track="1" if t - now < 600 else ""))
+    return SimpleNamespace(id="trip_%d" % i, trip=SimpleNamespace(route_id=route), stop_time_updates=stus)
+
+def run(subscriptions, snapshots=120):
+    random.seed(1)
+    registry = SubscriptionRegistry()
+    for n in range(subscriptions):
+        kind = random.random()
+        route = random.choice(ROUTES)
+        if kind < 0.6:
+            registry.subscribe("arrival", "nyct", stop_id="%s%02dN" % (route, random.randrange(STOPS)),
+                               route_id=route, minutes=random.choice([2, 5, 10]))
+        elif kind < 0.9:
+            registry.subscribe("track", "nyct", trip_id="trip_%d" % random.randrange(TRIPS))
+        else:
+            registry.subscribe("trip", "nyct", trip_id="trip_%d" % random.randrange(TRIPS))
+
+    trips = [make_trip(i, START) for i in range(TRIPS)]
+    registry.process("nyct", trips, now=START)
+    elapsed = 0
+    for k in range(1, snapshots + 1):
+        now = START + k * 30
+        for i in random.sample(range(TRIPS), TRIPS // 10):
+            trips[i] = make_trip(i, now)
+        t = time.perf_counter()
+        registry.process("nyct", trips, now=now)
+        elapsed += time.perf_counter() - t
+    sent = registry.delivery.delivered
+    print(f"{subscriptions:>7} subscriptions: {elapsed / snapshots * 1000:7.2f} ms/snapshot, "
+          f"{sent} notifications, {len(registry.subscriptions)} left")
+
+if __name__ == "__main__":
+    run(1000)
+    run(100000)
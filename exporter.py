@@ -0,0 +1,231 @@
+import os
+import re
+import uuid
+import argparse
+from datetime import datetime, timezone
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import proto.gtfs_realtime_pb2 as gtfs_realtime_pb2
+from nyct_refs import NYCTTrip
+from lirr_refs import LIRRTrip
+
+'''
+Columnar export of decoded realtime snapshots.
+
+Each snapshot is flattened into two tables
+- trips               one row per trip_update
+- stop_time_updates   one row per stop_time_update, with the NYCT/LIRR extension
+                      fields (actual_track, track, train_status) and delays
+
+Rows are buffered and written in batches as Parquet, partitioned by UTC time:
+    <out>/<table>/system=<system>/date=YYYY-MM-DD/hour=HH/part-<first>-<last>-<source>-<id>.parquet
+Both tables carry the source feed (an NYCT sub-feed like "gtfs-ace", or the
+system), and the random <id> keeps runs over the same window from overwriting
+each other.
+Stop, route and other low cardinality string columns are categoricals, which
+Parquet stores dictionary encoded. A partitioned table loads back with
+    pd.read_parquet("<out>/stop_time_updates", filters=[("date", "=", "2025-05-28")])
+
+Backfill from recorded feeds
+    python exporter.py --system nyct --source gtfs-ace --out data/export recordings/ace/*.pb
+'''
+# One index width for every file, so partitions stay readable together
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+CATEGORICAL = {
+    "trips": ["system", "source", "route_id", "start_date", "direction", "trip_type", "origin", "destination"],
+    "stop_time_updates": ["system", "source", "route_id", "stop_id", "actual_track", "scheduled_track", "track", "train_status"],
+}
+
+def partition(ts):
+    t = datetime.fromtimestamp(ts, timezone.utc)
+    return t.strftime("%Y-%m-%d"), t.strftime("%H")
+
+def flatten_nyct(feed, snapshot, source):
+    trips, stops = [], []
+    for entity in feed.entity:
+        if not entity.HasField("trip_update"):
+            continue
+        trip = NYCTTrip(entity.trip_update)
+        train = trip.train
+        trips.append({
+            "snapshot": snapshot,
+            "system": "nyct",
+            "source": source,
+            "trip_id": trip.id,
+            "route_id": trip.trip.route_id,
+            "start_date": trip.trip.start_date,
+            "start_time": trip.trip.start_time,
+            "direction": getattr(trip, "direction", ""),
+            "train_id": train.train_id if train else "",
+            "trip_type": train.trip_type if train else "",
+            "origin": train.origin if train else "",
+            "destination": train.destination if train else "",
+            "is_assigned": getattr(trip, "assigned", False),
+            "stop_count": len(trip.stop_time_updates),
+        })
+        for stu in trip.stop_time_updates:
+            nyct_update = getattr(stu, "nyct_update", None)
+            stops.append({
+                "snapshot": snapshot,
+                "system": "nyct",
+                "source": source,
+                "trip_id": trip.id,
+                "route_id": trip.trip.route_id,
+                # NYCT leaves stop_sequence out, a position in the remaining stops is not stable
+                "stop_sequence": stu.stu.stop_sequence if stu.stu.HasField("stop_sequence") else None,
+                "stop_id": stu.stop_id,
+                "arrival": stu.arrival,
+                "departure": stu.departure,
+                "arrival_delay": stu.stu.arrival.delay if stu.stu.HasField("arrival") else None,
+                "departure_delay": stu.stu.departure.delay if stu.stu.HasField("departure") else None,
+                "actual_track": getattr(stu, "actual_track", ""),
+                "scheduled_track": nyct_update.scheduled_track if nyct_update else "",
+                "track": "",
+                "train_status": "",
+            })
+    return trips, stops
+
+def flatten_lirr(feed, snapshot, source):
+    trips, stops = [], []
+    for entity in feed.entity:
+        if not entity.HasField("trip_update"):
+            continue
+        trip = LIRRTrip(entity.trip_update)
+        trips.append({
+            "snapshot": snapshot,
+            "system": "lirr",
+            "source": source,
+            "trip_id": trip.id,
+            "route_id": trip.trip.route_id,
+            "start_date": trip.trip.start_date,
+            "start_time": trip.trip.start_time,
+            "direction": str(trip.direction),
+            "train_id": "",
+            "trip_type": "",
+            "origin": "",
+            "destination": "",
+            "is_assigned": True,
+            "stop_count": len(trip.stop_time_updates),
+        })
+        for stu in trip.stop_time_updates:
+            stops.append({
+                "snapshot": snapshot,
+                "system": "lirr",
+                "source": source,
+                "trip_id": trip.id,
+                "route_id": trip.trip.route_id,
+                "stop_sequence": stu.stop_sequence,
+                "stop_id": stu.stop_id,
+                "arrival": stu.arrival,
+                "departure": stu.departure,
+                "arrival_delay": stu.stu.arrival.delay if stu.stu.HasField("arrival") else None,
+                "departure_delay": stu.stu.departure.delay if stu.stu.HasField("departure") else None,
+                "actual_track": "",
+                "scheduled_track": "",
+                "track": stu.track,
+                "train_status": stu.train_status,
+            })
+    return trips, stops
+
+FLATTEN = {
+    "nyct": flatten_nyct,
+    "lirr": flatten_lirr,
+}
+
+def dictionary_table(frame):
+    '''
+    Arrow table with every categorical column as dictionary<int32, string>.
+    pandas picks the narrowest index type per file, and files with int8 and
+    int16 indexes cannot be read back as one dataset.
+    '''
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    fields = [pa.field(field.name, DICTIONARY, field.nullable) if pa.types.is_dictionary(field.type) else field
+              for field in table.schema]
+    return table.cast(pa.schema(fields, metadata=table.schema.metadata))
+
+class SnapshotExporter:
+    def __init__(self, out_dir="data/export", batch_size=120):
+        self.out_dir = out_dir
+        self.batch_size = batch_size
+        # (system, date, hour) -> {"trips": [...], "stop_time_updates": [...], "snapshots": [...]}
+        self.buffers = {}
+        self.pending = 0
+
+    def add(self, system, feed, source=None):
+        '''
+        Buffer one parsed FeedMessage, flushing every `batch_size` snapshots.
+        `source` names the feed it came from, e.g. the NYCT sub-feed "gtfs-ace".
+        '''
+        snapshot = feed.header.timestamp
+        source = source or system
+        trips, stops = FLATTEN[system](feed, snapshot, source)
+        buffer = self.buffers.setdefault((system, source) + partition(snapshot), {
+            "trips": [],
+            "stop_time_updates": [],
+            "snapshots": [],
+        })
+        buffer["trips"].extend(trips)
+        buffer["stop_time_updates"].extend(stops)
+        buffer["snapshots"].append(snapshot)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def add_bytes(self, system, data, source=None):
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(data)
+        self.add(system, feed, source)
+
+    def flush(self):
+        written = []
+        for (system, source, date, hour), buffer in self.buffers.items():
+            # Sub-feeds share header timestamps and backfills can be re-run, never overwrite a part
+            name = "part-%d-%d-%s-%s.parquet" % (min(buffer["snapshots"]), max(buffer["snapshots"]),
+                                                 re.sub(r"[^\w-]", "_", source), uuid.uuid4().hex[:8])
+            for table in ("trips", "stop_time_updates"):
+                if not buffer[table]:
+                    continue
+                path = os.path.join(self.out_dir, table, "system=" + system, "date=" + date, "hour=" + hour)
+                os.makedirs(path, exist_ok=True)
+                frame = pd.DataFrame(buffer[table])
+                # The partition directories already hold the system
+                frame = frame.drop(columns=["system"])
+                if "stop_sequence" in frame:
+                    # Nullable ints, NYCT rows have no stop_sequence
+                    frame["stop_sequence"] = frame["stop_sequence"].astype("Int64")
+                for column in CATEGORICAL[table]:
+                    if column in frame:
+                        frame[column] = frame[column].astype("category")
+                pq.write_table(dictionary_table(frame), os.path.join(path, name))
+                written.append(os.path.join(path, name))
+        self.buffers = {}
+        self.pending = 0
+        return written
+
+def load(out_dir, table, **filters):
+    '''Read a table back, e.g. load("data/export", "trips", system="nyct", date="2025-05-28")'''
+    return pd.read_parquet(os.path.join(out_dir, table), filters=[(k, "=", v) for k, v in filters.items()] or None)
+
+def backfill(system, paths, out_dir, batch_size, source=None):
+    exporter = SnapshotExporter(out_dir, batch_size)
+    for path in sorted(paths):
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            exporter.add_bytes(system, data, source)
+        except Exception as e:
+            print(f"Failed to parse {path}, skipping. Error:", e)
+    files = exporter.flush()
+    print(f"Exported {len(paths)} snapshots to {out_dir}")
+    return files
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill Parquet exports from recorded GTFS-RT .pb files")
+    parser.add_argument("files", nargs="+", help="recorded FeedMessage files")
+    parser.add_argument("--system", choices=sorted(FLATTEN), required=True)
+    parser.add_argument("--out", default="data/export")
+    parser.add_argument("--batch-size", type=int, default=120, help="snapshots per Parquet file")
+    parser.add_argument("--source", help="feed the recordings come from, e.g. gtfs-ace, defaults to the system")
+    args = parser.parse_args()
+    backfill(args.system, args.files, args.out, args.batch_size, args.source)
@@ -0,0 +1,114 @@
+import numpy as np
+from nyct_refs import get_station_name
+
+'''
+Headways between consecutive trains at each stop, per route and direction.
+
+Every NYCTStopTimeUpdate in the snapshot becomes one (route, direction, stop, time)
+entry. Entries are sorted by (route, direction, stop, time) in one pass and the
+headway is the time difference to the previous entry of the same group.
+
+A headway is compared against the median headway of its route and direction:
+- bunched  headway < BUNCH_RATIO * median
+- gap      headway > GAP_RATIO * median
+'''
+BUNCH_RATIO = 0.25
+GAP_RATIO = 2.0
+
+def flatten(trips, line="ALL"):
+    trip_ids, routes, directions, stops, times, owners = [], [], [], [], [], []
+    for trip in trips:
+        route_id = trip.trip.route_id
+        if line != "ALL" and route_id.upper() != line:
+            continue
+        direction = getattr(trip, "direction", "")
+        owner = len(trip_ids)
+        trip_ids.append(trip.id)
+        for stu in trip.stop_time_updates:
+            t = stu.arrival or stu.departure
+            if not t:
+                continue
+            routes.append(route_id)
+            directions.append(direction)
+            stops.append(stu.stop_id)
+            times.append(t)
+            owners.append(owner)
+    return (trip_ids, np.array(routes), np.array(directions), np.array(stops),
+            np.array(times, dtype=np.int64), np.array(owners, dtype=np.int64))
+
+def compute_headways(trips, line="ALL", bunch_ratio=BUNCH_RATIO, gap_ratio=GAP_RATIO):
+    trip_ids, routes, directions, stops, times, owners = flatten(trips, line)
+    if len(times) < 2:
+        return {"summary": [], "headways": []}
+
+    route_keys, route_codes = np.unique(routes, return_inverse=True)
+    direction_keys, direction_codes = np.unique(directions, return_inverse=True)
+    stop_keys, stop_codes = np.unique(stops, return_inverse=True)
+
+    # One integer per (route, direction) and per (route, direction, stop)
+    line_codes = route_codes * len(direction_keys) + direction_codes
+    group_codes = line_codes * len(stop_keys) + stop_codes
+
+    order = np.lexsort((times, group_codes))
+    same = group_codes[order[1:]] == group_codes[order[:-1]]
+    leader = order[:-1][same]
+    follower = order[1:][same]
+    headway = times[follower] - times[leader]
+    if len(headway) == 0:
+        return {"summary": [], "headways": []}
+
+    # Median headway per (route, direction)
+    lines = line_codes[leader]
+    by_line = np.lexsort((headway, lines))
+    sorted_lines = lines[by_line]
+    sorted_headway = headway[by_line]
+    line_keys, starts, counts = np.unique(sorted_lines, return_index=True, return_counts=True)
+    median = (sorted_headway[starts + (counts - 1) // 2] + sorted_headway[starts + counts // 2]) / 2
+    line_index = np.searchsorted(line_keys, lines)
+    reference = median[line_index]
+
+    bunched = headway < bunch_ratio * reference
+    gap = headway > gap_ratio * reference
+    bunched_counts = np.bincount(line_index, weights=bunched, minlength=len(line_keys))
+    gap_counts = np.bincount(line_index, weights=gap, minlength=len(line_keys))
+
+    summary = []
+    for i, key in enumerate(line_keys.tolist()):
+        summary.append({
+            "route_id": str(route_keys[key // len(direction_keys)]),
+            "direction": str(direction_keys[key % len(direction_keys)]),
+            "median_headway": float(median[i]),
+            "headways": int(counts[i]),
+            "bunched": int(bunched_counts[i]),
+            "gaps": int(gap_counts[i]),
+        })
+
+    route_ids = route_keys.tolist()
+    direction_names = direction_keys.tolist()
+    stop_ids = stop_keys.tolist()
+    stop_names = [get_station_name(stop_id) for stop_id in stop_ids]
+    rows = []
+    leader_trips = owners[leader].tolist()
+    follower_trips = owners[follower].tolist()
+    leader_times = times[leader].tolist()
+    follower_times = times[follower].tolist()
+    route_list = route_codes[leader].tolist()
+    direction_list = direction_codes[leader].tolist()
+    stop_list = stop_codes[leader].tolist()
+    bunched_list = bunched.tolist()
+    gap_list = gap.tolist()
+    for i, h in enumerate(headway.tolist()):
+        rows.append({
+            "route_id": route_ids[route_list[i]],
+            "direction": direction_names[direction_list[i]],
+            "stop_id": stop_ids[stop_list[i]],
+            "stop_name": stop_names[stop_list[i]],
+            "leader_trip_id": trip_ids[leader_trips[i]],
+            "follower_trip_id": trip_ids[follower_trips[i]],
+            "leader_time": leader_times[i],
+            "follower_time": follower_times[i],
+            "headway": h,
+            "bunched": bunched_list[i],
+            "gap": gap_list[i],
+        })
+    return {"summary": summary, "headways": rows}
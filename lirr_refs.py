@@ -1,6 +1,10 @@
 import os
 import csv
 import requests
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from registry import REGISTRY
 import proto.gtfs_realtime_pb2 as gtfs_realtime_pb2
 import proto.gtfs_realtime_lirr_pb2 as gtfs_realtime_lirr_pb2
 
@@ -33,19 +37,15 @@ import proto.gtfs_realtime_lirr_pb2 as gtfs_realtime_lirr_pb2
   }
 }
 '''
-ROUTES = {}
 SCHEDULE = {}
-STOP_NAMES = {}
-ROUTE_COLORS = {}
-FEED_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/lirr%2Fgtfs-lirr"
+FEED_BASE = os.environ.get("MTA_FEED_BASE", "https://api-endpoint.mta.info").rstrip("/")
+FEED_URL = FEED_BASE + "/Dataservice/mtagtfsfeeds/lirr%2Fgtfs-lirr"
+TIMEZONE = ZoneInfo("America/New_York")
+# Realtime data older than this is treated as missing
+STALE_AFTER = 300
 
 def get_station_name(stop_id):
-    stop_id = stop_id.strip()
-    if stop_id in STOP_NAMES:
-        return STOP_NAMES[stop_id]
-    if stop_id[:-1] in STOP_NAMES:
-        return STOP_NAMES[stop_id[:-1]]
-    return stop_id
+    return REGISTRY.stop_name("lirr", stop_id)
 
 def fetch_lirr_feed():
     response = requests.get(FEED_URL)
@@ -55,18 +55,31 @@ def fetch_lirr_feed():
 class LIRRFeed:
     def __init__(self, line):
         print(f"Fetching LIRR feed for line: {line}")
-        feed_bytes = fetch_lirr_feed()
+        try:
+            feed_bytes = fetch_lirr_feed()
+        except requests.RequestException as e:
+            print("Failed to fetch LIRR feed. Error:", e)
+            feed_bytes = None
         self.feed = gtfs_realtime_pb2.FeedMessage()
+        self.timestamps = []
 
         if feed_bytes:
             try:
                 self.feed.ParseFromString(feed_bytes)
+                self.timestamps.append(self.feed.header.timestamp)
             except Exception as e:
                 print("Failed to parse LIRR feed. Error:", e)
                 self.feed = None
         else:
             self.feed = None
 
+    def is_stale(self, now=None):
+        '''True when there is no realtime data or it is older than STALE_AFTER'''
+        if not self.feed or not self.timestamps:
+            return True
+        now = now if now is not None else datetime.now().timestamp()
+        return now - self.timestamps[0] > STALE_AFTER
+
     @property
     def trips(self):
         if not self.feed:
@@ -155,9 +168,11 @@ class LIRRStaticData:
             return
         with open(filepath, newline='', encoding='utf-8') as csvfile:
             reader = csv.DictReader(csvfile)
+            count = 0
             for row in reader:
-                ROUTES[row['route_id'].strip()] = row['route_long_name'].strip()
-        print("Trips loaded for LIRR:", len(ROUTES))
+                REGISTRY.add_route("lirr", row['route_id'].strip(), row['route_long_name'].strip())
+                count += 1
+        print("Trips loaded for LIRR:", count)
 
     def _load_stop_names(self, filepath="data/lirr/stops.txt"):
         if not os.path.exists(filepath):
@@ -165,10 +180,13 @@ class LIRRStaticData:
             return
         with open(filepath, newline='', encoding='utf-8') as csvfile:
             reader = csv.DictReader(csvfile)
+            count = 0
             for row in reader:
-                STOP_NAMES[row["stop_id"].strip()] = row["stop_name"].strip()
+                REGISTRY.add_stop("lirr", row["stop_id"].strip(), row["stop_name"].strip(),
+                                  float(row["stop_lat"]), float(row["stop_lon"]))
+                count += 1
 
-            print("Station names loaded for LIRR:", len(STOP_NAMES))
+            print("Station names loaded for LIRR:", count)
 
     
     def _load_route_colors(self, filepath="data/lirr/routes.txt"):
@@ -181,10 +199,7 @@ class LIRRStaticData:
                 route_id = row["route_id"].strip()
                 color = "#" + row["route_color"].strip()
                 text_color = "#" + row["route_text_color"].strip()
-                ROUTE_COLORS[route_id] = {
-                    "color": color,
-                    "text_color": text_color
-                }
+                REGISTRY.add_route("lirr", route_id, color=color, text_color=text_color)
 
     def _load_schedule(self, filepath="data/lirr/stop_times.txt"):
         if not os.path.exists(filepath):
@@ -200,9 +215,12 @@ class LIRRStaticData:
                 SCHEDULE[(trip_id, stop_sequence)] = arrival_time
 
     def get_headsign(self, route_id):
-        for id, head in ROUTES.items():
+        name = REGISTRY.route_name("lirr", route_id)
+        if name:
+            return name
+        for id in REGISTRY.route_ids.get("lirr", {}):
             if route_id in id:
-                return head
+                return REGISTRY.route_name("lirr", id) or route_id
         return route_id
     
     def get_schedule(self, trip_id, stop_sequence):
@@ -214,4 +232,160 @@ class LIRRStaticData:
         return SCHEDULE.get((trip_id, stop_sequence), "")
     
     def get_colors(self, route_id):
-        return ROUTE_COLORS.get(route_id, {"color": "#FFFFFF", "text_color": "#000000"})
\ No newline at end of file
+        return REGISTRY.route_colors("lirr", route_id)
+
+def gtfs_seconds(hms):
+    # GTFS times may run past 24:00:00 for trips that continue after midnight
+    h, m, sec = hms.strip().split(":")
+    return int(h) * 3600 + int(m) * 60 + int(sec)
+
+class LIRRScheduledService:
+    '''
+    Scheduled service from stop_times.txt, used when the realtime feed is missing
+    or stale. Stop times are kept sorted by time of day, per stop and overall, so
+    "departures from X in the next N minutes" is a binary search. Service days
+    come from calendar_dates.txt, and since GTFS times can exceed 24:00 the
+    previous service day is searched as well.
+    '''
+    def __init__(self):
+        self.trips = {}
+        self.services = {}
+        self.trip_stops = {}
+        self.by_stop = {}
+        self.all_times = []
+        self.all_entries = []
+        self._load_trips()
+        self._load_calendar_dates()
+        self._load_stop_times()
+
+    def _load_trips(self, filepath="data/lirr/trips.txt"):
+        if not os.path.exists(filepath):
+            print("Failed to find trips.txt for LIRR")
+            return
+        with open(filepath, newline='', encoding='utf-8') as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                self.trips[row["trip_id"].strip()] = {
+                    "route_id": row["route_id"].strip(),
+                    "service_id": row["service_id"].strip(),
+                    "headsign": row["trip_headsign"].strip(),
+                    "direction_id": row["direction_id"].strip(),
+                }
+
+    def _load_calendar_dates(self, filepath="data/lirr/calendar_dates.txt"):
+        if not os.path.exists(filepath):
+            print("Failed to find calendar_dates.txt for LIRR")
+            return
+        with open(filepath, newline='', encoding='utf-8') as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                services = self.services.setdefault(row["date"].strip(), set())
+                # 1 adds service on the date, 2 removes it
+                if row["exception_type"].strip() == "1":
+                    services.add(row["service_id"].strip())
+                else:
+                    services.discard(row["service_id"].strip())
+
+    def _load_stop_times(self, filepath="data/lirr/stop_times.txt"):
+        if not os.path.exists(filepath):
+            print("Failed to find stop_times.txt for LIRR")
+            return
+        by_stop = {}
+        everything = []
+        with open(filepath, newline='', encoding='utf-8') as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                trip_id = row["trip_id"].strip()
+                stop_id = row["stop_id"].strip()
+                entry = (
+                    gtfs_seconds(row["departure_time"] or row["arrival_time"]),
+                    trip_id,
+                    int(row["stop_sequence"]),
+                    stop_id,
+                    gtfs_seconds(row["arrival_time"] or row["departure_time"]),
+                )
+                self.trip_stops.setdefault(trip_id, []).append(entry)
+                by_stop.setdefault(stop_id, []).append(entry)
+                everything.append(entry)
+
+        for stops in self.trip_stops.values():
+            stops.sort(key=lambda e: e[2])
+        # Parallel (times, entries) lists so bisect works on plain ints
+        for stop_id, entries in by_stop.items():
+            entries.sort()
+            self.by_stop[stop_id] = ([e[0] for e in entries], entries)
+        everything.sort()
+        self.all_times = [e[0] for e in everything]
+        self.all_entries = everything
+        print("Scheduled stop times loaded for LIRR:", len(everything))
+
+    def _service_days(self, now):
+        # (date, base timestamp) for yesterday and today. GTFS times count from
+        # noon minus 12h, which is not midnight on the days clocks change
+        local = datetime.fromtimestamp(now, TIMEZONE)
+        days = []
+        for back in (1, 0):
+            day = (local - timedelta(days=back)).date()
+            noon = datetime(day.year, day.month, day.day, 12, tzinfo=TIMEZONE).timestamp()
+            days.append((day.strftime("%Y%m%d"), noon - 12 * 3600))
+        return days
+
+    def _window(self, times, entries, now, minutes):
+        results = []
+        for date, midnight in self._service_days(now):
+            services = self.services.get(date)
+            if not services:
+                continue
+            start = now - midnight
+            lo = bisect_left(times, start)
+            hi = bisect_right(times, start + minutes * 60)
+            for entry in entries[lo:hi]:
+                trip = self.trips.get(entry[1])
+                if trip and trip["service_id"] in services:
+                    results.append((midnight, entry))
+        return results
+
+    def departures(self, stop_id, minutes=60, now=None):
+        '''Scheduled departures from stop_id in the next `minutes`, soonest first'''
+        now = now if now is not None else datetime.now().timestamp()
+        indexed = self.by_stop.get(stop_id)
+        if not indexed:
+            return []
+        results = []
+        for midnight, (dep, trip_id, seq, stop, arr) in self._window(indexed[0], indexed[1], now, minutes):
+            # Trips ending here arrive, they do not depart
+            if seq == self.trip_stops[trip_id][-1][2]:
+                continue
+            trip = self.trips[trip_id]
+            results.append({
+                "trip_id": trip_id,
+                "route_id": trip["route_id"],
+                "headsign": trip["headsign"],
+                "stop_id": stop,
+                "stop_name": get_station_name(stop),
+                "stop_sequence": seq,
+                "departure": int(midnight + dep),
+                "scheduled_only": True,
+            })
+        results.sort(key=lambda r: r["departure"])
+        return results
+
+    def active_trips(self, minutes=60, now=None):
+        '''
+        Trips with a scheduled stop in the next `minutes`, as
+        (trip_id, route_id, [(stop_sequence, stop_id, arrival, departure), ...])
+        with the remaining stops in UNIX time
+        '''
+        now = now if now is not None else datetime.now().timestamp()
+        seen = {}
+        for midnight, entry in self._window(self.all_times, self.all_entries, now, minutes):
+            seen.setdefault(entry[1], midnight)
+        trips = []
+        for trip_id, midnight in seen.items():
+            stops = [
+                (seq, stop_id, int(midnight + arr), int(midnight + dep))
+                for dep, _, seq, stop_id, arr in self.trip_stops[trip_id]
+                if midnight + dep >= now
+            ]
+            trips.append((trip_id, self.trips[trip_id]["route_id"], stops))
+        return trips
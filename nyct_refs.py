@@ -1,8 +1,15 @@
 import proto.gtfs_realtime_pb2 as gtfs_realtime_pb2
 import proto.gtfs_realtime_NYCT_pb2 as gtfs_realtime_nyct_pb2
 import csv
+import heapq
 import os
+import re
+import sys
+import threading
+import time
 import requests
+from collections import namedtuple
+from registry import REGISTRY
 
 '''
 FeedMessage
@@ -43,84 +50,245 @@ FeedMessage
             - replacement_period
 '''
 TRIPS = {}
-STOP_NAMES = {}
-ROUTE_COLORS = {}
+# Point at a local stand-in (see standin.py) with MTA_FEED_BASE=http://127.0.0.1:8765
+FEED_BASE = os.environ.get("MTA_FEED_BASE", "https://api-endpoint.mta.info").rstrip("/")
+# Sub-feeds are not fetched again within this many seconds
+REFRESH_INTERVAL = 5
+FETCH_TIMEOUT = 10
+# Cached row views per sub-feed snapshot
+MAX_VIEWS = 64
+# A sub-feed that has not been fetched successfully for this long is left out
+STALE_AFTER = 300
+# Called with each newly decoded NYCTSnapshot, e.g. to learn from every feed update
+SNAPSHOT_LISTENERS = []
 FEED_URLS = [
-    (["1", "2", "3", "4", "5", "6", "7", "S"], "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs"),
-    (["A", "C", "E", "SR"], "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-ace"),
-    (["B", "D", "F", "M", "SF"], "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-bdfm"),
-    (["G"], "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-g"),
-    (["J", "Z"], "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-jz"),
-    (["L"], "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-l"),
-    (["N", "Q", "R", "W"], "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-nqrw"),
-    (["SIR"], "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-sir"),
+    (["1", "2", "3", "4", "5", "6", "7", "S"], FEED_BASE + "/Dataservice/mtagtfsfeeds/nyct%2Fgtfs"),
+    (["A", "C", "E", "SR"], FEED_BASE + "/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-ace"),
+    (["B", "D", "F", "M", "SF"], FEED_BASE + "/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-bdfm"),
+    (["G"], FEED_BASE + "/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-g"),
+    (["J", "Z"], FEED_BASE + "/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-jz"),
+    (["L"], FEED_BASE + "/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-l"),
+    (["N", "Q", "R", "W"], FEED_BASE + "/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-nqrw"),
+    (["SIR"], FEED_BASE + "/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-sir"),
 ]
 
+# Decoded train_id, see NYCTTrip for the format
+NYCTTrainId = namedtuple("NYCTTrainId", ["train_id", "trip_type", "line", "origin_time", "origin", "destination"])
+TRIP_TYPES = {
+    "0": "scheduled",
+    "=": "reroute",
+    "/": "skip_stop",
+    "$": "turn",
+}
+TRAIN_ID_PATTERN = re.compile(r"^\s*([0=/$])(\S+)\s+(\d{1,2})(\d{2})(\+?)\s+(\S+?)/(\S+)\s*$")
+TRAIN_IDS = {}
+TRAIN_ID_CACHE_SIZE = 50000
+
+def decode_train_id(train_id):
+    '''
+    Decode a train_id like "06 0123+ PEL/BBR" into a NYCTTrainId. origin_time is
+    in seconds past midnight. Records are cached by train_id across snapshots and
+    their strings interned, ids that do not match the format decode to trip_type "unknown".
+    '''
+    decoded = TRAIN_IDS.get(train_id)
+    if decoded is not None:
+        return decoded
+
+    match = TRAIN_ID_PATTERN.match(train_id)
+    if match:
+        designator, line, hours, minutes, half, origin, destination = match.groups()
+        decoded = NYCTTrainId(
+            sys.intern(train_id),
+            TRIP_TYPES[designator],
+            sys.intern(line),
+            int(hours) * 3600 + int(minutes) * 60 + (30 if half else 0),
+            sys.intern(origin),
+            sys.intern(destination),
+        )
+    else:
+        decoded = NYCTTrainId(sys.intern(train_id), "unknown", "", None, "", "")
+
+    # Train ids repeat across snapshots but not across days, so start over when full
+    if len(TRAIN_IDS) >= TRAIN_ID_CACHE_SIZE:
+        TRAIN_IDS.clear()
+    TRAIN_IDS[train_id] = decoded
+    return decoded
+
 def get_station_name(stop_id):
-    stop_id = stop_id.strip()
-    if stop_id in STOP_NAMES:
-        return STOP_NAMES[stop_id]
-    if stop_id[:-1] in STOP_NAMES:
-        return STOP_NAMES[stop_id[:-1]]
-    return stop_id
-
-def fetch_feed(line):
-    line = line.upper()
-    feeds = []
-
-    # If "ALL", fetch all feeds and concatenate entities
-    if line == "ALL":
-        for routes, url in FEED_URLS:
-            resp = requests.get(url)
-            resp.raise_for_status()
-            feeds.append(resp.content)
-        return feeds  # Return a list of bytes for all feeds
+    return REGISTRY.stop_name("nyct", stop_id)
+
+def header_timestamp(data):
+    '''
+    Header timestamp of a serialized FeedMessage, read from the header alone
+    without decoding the entities. None when the header is not the first field.
+    '''
+    if data[:1] != b"\x0a":
+        return None
+    length = shift = 0
+    pos = 1
+    while pos < len(data):
+        byte = data[pos]
+        pos += 1
+        length |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    header = gtfs_realtime_pb2.FeedHeader()
+    try:
+        header.ParseFromString(data[pos:pos + length])
+    except Exception:
+        return None
+    return header.timestamp if header.HasField("timestamp") else None
 
-    # Otherwise, fetch the feed for the specific line
-    for routes, url in FEED_URLS:
-        if line in routes:
-            resp = requests.get(url)
+class NYCTSnapshot:
+    '''
+    One decoded sub-feed at one header timestamp. Never changes once built, rows
+    derived from its trips are cached on it and go away with it.
+    '''
+    def __init__(self, timestamp=None, trips=()):
+        self.timestamp = timestamp
+        self.decoded_at = time.time() if timestamp is not None else None
+        self.trips = list(trips)
+        self.index = NYCTTripIndex(self.trips)
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def filter_trips(self, trip_type=None, origin=None, destination=None, line=None):
+        return self.index.filter(trip_type, origin, destination, line)
+
+    def rows(self, key, build):
+        rows = self.views.get(key)
+        if rows is None:
+            rows = build(self)
+            with self.lock:
+                # Keys come from client filters and a quiet sub-feed keeps its snapshot for hours
+                while len(self.views) >= MAX_VIEWS:
+                    del self.views[next(iter(self.views))]
+                self.views[key] = rows
+        return rows
+
+class NYCTPartition:
+    '''
+    One sub-feed of FEED_URLS. refresh() fetches it at most every
+    REFRESH_INTERVAL seconds and decodes it only when its header timestamp
+    moved, otherwise the current snapshot is kept. A failed fetch, an empty body
+    or a feed that has no header timestamp or does not parse also keeps the last
+    good snapshot, fetched_at tells its age. The fetch runs outside the lock.
+    Each new snapshot is passed to SNAPSHOT_LISTENERS.
+    is_stale() is True once the last good fetch is older than STALE_AFTER.
+    '''
+    def __init__(self, routes, url):
+        self.routes = routes
+        self.url = url
+        self.snapshot = NYCTSnapshot()
+        self.fetched_at = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def refresh(self, now=None):
+        now = now if now is not None else time.time()
+        # One thread fetches per interval, the others keep serving the current snapshot
+        with self.lock:
+            if now - self.checked_at < REFRESH_INTERVAL:
+                return False
+            self.checked_at = now
+        try:
+            resp = requests.get(self.url, timeout=FETCH_TIMEOUT)
             resp.raise_for_status()
-            return resp.content
-    return None
+        except requests.RequestException as e:
+            print("Failed to fetch NYCT feed, keeping last snapshot. Error:", e)
+            return False
+        data = resp.content
+        if data[:1] == b'{' or data[:1] == b'<':
+            print("Warning: Feed does not look like protobuf. First 100 bytes:", data[:100])
+            return False
+
+        timestamp = header_timestamp(data)
+        if not timestamp:
+            # Empty and truncated bodies parse as feeds without a header
+            print("Warning: Feed has no header timestamp, keeping last snapshot.")
+            return False
+        self.fetched_at = now
+        if timestamp == self.snapshot.timestamp:
+            return False
+        feed = gtfs_realtime_pb2.FeedMessage()
+        try:
+            feed.ParseFromString(data)
+        except Exception as e:
+            print("Failed to parse feed, keeping last snapshot. Error:", e)
+            return False
+        trips = [NYCTTrip(entity.trip_update) for entity in feed.entity if entity.HasField("trip_update")]
+        snapshot = NYCTSnapshot(feed.header.timestamp, trips)
+        with self.lock:
+            if snapshot.timestamp == self.snapshot.timestamp:
+                return False
+            self.snapshot = snapshot
+        for listener in SNAPSHOT_LISTENERS:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print("Snapshot listener failed. Error:", e)
+        return True
+
+    def is_stale(self, now=None):
+        now = now if now is not None else time.time()
+        return self.fetched_at is None or now - self.fetched_at > STALE_AFTER
+
+    def freshness(self, now=None):
+        now = now if now is not None else time.time()
+        snapshot = self.snapshot
+        return {
+            "routes": self.routes,
+            "timestamp": snapshot.timestamp,
+            "age": round(now - snapshot.timestamp) if snapshot.timestamp else None,
+            "fetched_at": self.fetched_at,
+            "decoded_at": snapshot.decoded_at,
+            "trips": len(snapshot.trips),
+            "stale": self.is_stale(now),
+        }
 
 class NYCTFeed:
+    '''
+    The current snapshots of the sub-feeds serving `line`, all of them for "ALL".
+    Only sub-feeds whose header timestamp advanced are decoded again,
+    timestamps has one entry per snapshot. Stale sub-feeds are left out.
+    '''
     def __init__(self, line):
-        if line.upper() == "ALL":
+        self._trips = None
+        line = line.upper()
+        if line == "ALL":
             print("Fetching all NYCT feeds...")
-            feeds_bytes = fetch_feed(line)
-            self.feed = gtfs_realtime_pb2.FeedMessage()
-            self.feed.entity.extend([])
-            
-            for feed_bytes in feeds_bytes:
-                # Debug: print first 100 bytes and try to detect HTML or JSON
-                if feed_bytes[:1] == b'{' or feed_bytes[:1] == b'<':
-                    print("Warning: Feed does not look like protobuf. First 100 bytes:", feed_bytes[:100])
-                    continue
-
-                try:
-                    temp_feed = gtfs_realtime_pb2.FeedMessage()
-                    temp_feed.ParseFromString(feed_bytes)
-                    self.feed.entity.extend(temp_feed.entity)
-                except Exception as e:
-                    print("Failed to parse feed, skipping. Error:", e)
-                    continue
-            print(f"Fetched {len(self.feed.entity)} entities from all feeds.")
+            self.partitions = PARTITIONS
         else:
-            bytes = fetch_feed(line)
-            self.feed = gtfs_realtime_pb2.FeedMessage()
-            if bytes:
-                self.feed.ParseFromString(bytes)
-            else:
-                self.feed = None
+            self.partitions = [partition for partition in PARTITIONS if line in partition.routes]
+        updated = sum(partition.refresh() for partition in self.partitions)
+        now = time.time()
+        stale = [partition for partition in self.partitions
+                 if partition.snapshot.timestamp is not None and partition.is_stale(now)]
+        if stale:
+            print("Warning: Leaving out stale NYCT feeds:", ", ".join("/".join(partition.routes) for partition in stale))
+        self.snapshots = [partition.snapshot for partition in self.partitions
+                          if partition.snapshot.timestamp is not None and not partition.is_stale(now)]
+        self.timestamps = [snapshot.timestamp for snapshot in self.snapshots]
+        if line == "ALL":
+            print(f"{len(self.trips)} trips from all feeds, {updated} of {len(self.partitions)} feeds updated.")
 
     @property
     def trips(self):
-        trips = []
-        for entity in self.feed.entity:
-            if entity.HasField("trip_update"):
-                trips.append(NYCTTrip(entity.trip_update))
-        return trips
+        if self._trips is None:
+            self._trips = [trip for snapshot in self.snapshots for trip in snapshot.trips]
+        return self._trips
+
+    def filter_trips(self, trip_type=None, origin=None, destination=None, line=None):
+        return [trip for snapshot in self.snapshots
+                for trip in snapshot.filter_trips(trip_type, origin, destination, line)]
+
+    def merged_rows(self, key, build, sort_key):
+        '''
+        build(snapshot) returns rows sorted by sort_key. Rows are built once per
+        snapshot and key, so only updated sub-feeds are rebuilt, and merged in order.
+        '''
+        return list(heapq.merge(*(snapshot.rows(key, build) for snapshot in self.snapshots), key=sort_key))
 
     # NOT USED PER DOCUMENTATION
     @property
@@ -145,14 +313,16 @@ class NYCTTrip:
         #     Note: Origin times will not change when there is a trip type change.
         #   - This is followed by a three character “Origin Location” / “Destination Location”.
         # See: https://www.mta.info/document/134521
+        # decode_train_id turns it into a NYCTTrainId, available as self.train
         if self.trip.HasExtension(gtfs_realtime_nyct_pb2.nyct_trip_descriptor):
             self.nyct_trip = self.trip.Extensions[gtfs_realtime_nyct_pb2.nyct_trip_descriptor]
             self.direction = gtfs_realtime_nyct_pb2.NyctTripDescriptor.Direction.Name(self.nyct_trip.direction)
             self.assigned = self.nyct_trip.is_assigned
+            self.train = decode_train_id(self.nyct_trip.train_id)
             # self.direction = self.nyct_trip.direction
             # self.train_id = self.nyct_trip.train_id
         else:
-            pass
+            self.train = None
             # self.direction = None
             # self.train_id = None
 
@@ -160,6 +330,42 @@ class NYCTTrip:
     def id(self):
         return self.trip.trip_id
 
+# Secondary indexes over the decoded train_ids of one snapshot
+class NYCTTripIndex:
+    def __init__(self, trips):
+        self.trips = trips
+        self.by_trip_type = {}
+        self.by_origin = {}
+        self.by_destination = {}
+        self.by_line = {}
+        for trip in trips:
+            train = trip.train
+            if train is None:
+                continue
+            self.by_trip_type.setdefault(train.trip_type, []).append(trip)
+            self.by_origin.setdefault(train.origin, []).append(trip)
+            self.by_destination.setdefault(train.destination, []).append(trip)
+            self.by_line.setdefault(trip.trip.route_id, []).append(trip)
+
+    def filter(self, trip_type=None, origin=None, destination=None, line=None):
+        # Start from the smallest matching bucket and check the rest on its trips
+        buckets = []
+        if trip_type:
+            buckets.append(self.by_trip_type.get(trip_type.lower(), []))
+        if origin:
+            buckets.append(self.by_origin.get(origin.upper(), []))
+        if destination:
+            buckets.append(self.by_destination.get(destination.upper(), []))
+        if line:
+            buckets.append(self.by_line.get(line.upper(), []))
+        if not buckets:
+            return list(self.trips)
+        buckets.sort(key=len)
+        if len(buckets) == 1:
+            return list(buckets[0])
+        rest = [{id(trip) for trip in bucket} for bucket in buckets[1:]]
+        return [trip for trip in buckets[0] if all(id(trip) in ids for ids in rest)]
+
 # All future stop times for trip, past stoptimes are omitted. 
 # First StopTime in seuqence is the stop the train is currently approaching, stopped at or about to leave
 # Stop is dropped from sequence when train departs station
@@ -202,11 +408,20 @@ class NYCTStaticData:
             print("Failed to find stops.txt for NYCT")
             return
         with open(filepath, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                STOP_NAMES[row["stop_id"].strip()] = row["stop_name"].strip()
+            rows = list(csv.DictReader(csvfile))
+        # Parents first so platforms like 101N/101S resolve to 101
+        rows.sort(key=lambda row: bool(row.get("parent_station", "").strip()))
+        for row in rows:
+            stop_id = row["stop_id"].strip()
+            parent = row.get("parent_station", "").strip()
+            REGISTRY.add_stop("nyct", stop_id, row["stop_name"].strip(),
+                              float(row["stop_lat"]), float(row["stop_lon"]), parent)
+            if not parent:
+                # Realtime ids carry the direction even when stops.txt lacks the platform
+                REGISTRY.alias_stop("nyct", stop_id + "N", stop_id)
+                REGISTRY.alias_stop("nyct", stop_id + "S", stop_id)
 
-            print("Station names loaded for NYCT:", len(STOP_NAMES))
+        print("Station names loaded for NYCT:", len(rows))
 
     def _load_route_colors(self, filepath="data/nyct/routes.txt"):
         if not os.path.exists(filepath):
@@ -218,10 +433,7 @@ class NYCTStaticData:
                 route_id = row["route_id"].strip()
                 color = "#" + row["route_color"].strip()
                 text_color = "#" + row["route_text_color"].strip()
-                ROUTE_COLORS[route_id] = {
-                    "color": color,
-                    "text_color": text_color
-                }
+                REGISTRY.add_route("nyct", route_id, row["route_long_name"].strip(), color, text_color)
     
     def get_headsign(self, trip_id):
         for id, head in TRIPS.items():
@@ -230,4 +442,22 @@ class NYCTStaticData:
         return trip_id
     
     def get_colors(self, route_id):
-        return ROUTE_COLORS.get(route_id, {"color": "#FFFFFF", "text_color": "#000000"})
+        return REGISTRY.route_colors("nyct", route_id)
+
+# The ALL view, partitioned by sub-feed and shared by every NYCTFeed
+PARTITIONS = [NYCTPartition(routes, url) for routes, url in FEED_URLS]
+
+def start_refresher(interval=REFRESH_INTERVAL):
+    '''
+    Refresh every partition from a daemon thread, so new snapshots are decoded
+    (and SNAPSHOT_LISTENERS called) without waiting for a request.
+    '''
+    def run():
+        while True:
+            for partition in PARTITIONS:
+                partition.refresh()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
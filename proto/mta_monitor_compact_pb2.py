@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: mta-monitor-compact.proto
+# Protobuf Python Version: 5.29.0
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    5,
+    29,
+    0,
+    '',
+    'mta-monitor-compact.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x19mta-monitor-compact.proto\x12\x0bmta_monitor\"\xe3\x01\n\rCompactTrains\x12\x0e\n\x06system\x18\x01 \x01(\t\x12\x11\n\ttimestamp\x18\x02 \x01(\x04\x12\x0f\n\x07strings\x18\x03 \x03(\t\x12\"\n\x06routes\x18\x04 \x03(\x0b\x32\x12.mta_monitor.Route\x12 \n\x05stops\x18\x05 \x03(\x0b\x32\x11.mta_monitor.Stop\x12+\n\x0bnyct_trains\x18\x06 \x03(\x0b\x32\x16.mta_monitor.NyctTrain\x12+\n\x0blirr_trains\x18\x07 \x03(\x0b\x32\x16.mta_monitor.LirrTrain\"J\n\x05Route\x12\x10\n\x08route_id\x18\x01 \x01(\r\x12\x0c\n\x04name\x18\x02 \x01(\r\x12\r\n\x05\x63olor\x18\x03 \x01(\r\x12\x12\n\ntext_color\x18\x04 \x01(\r\"%\n\x04Stop\x12\x0f\n\x07stop_id\x18\x01 \x01(\r\x12\x0c\n\x04name\x18\x02 \x01(\r\"\xc5\x01\n\tNyctTrain\x12\r\n\x05route\x18\x01 \x01(\r\x12\x0f\n\x07trip_id\x18\x02 \x01(\t\x12\x10\n\x08train_id\x18\x03 \x01(\t\x12\x11\n\ttrip_name\x18\x04 \x01(\r\x12\x11\n\tdirection\x18\x05 \x01(\r\x12\x11\n\tnext_stop\x18\x06 \x01(\r\x12\x11\n\tdeparture\x18\x07 \x01(\r\x12\x0f\n\x07\x61rrival\x18\x08 \x01(\r\x12\x14\n\x0c\x61\x63tual_track\x18\t \x01(\r\x12\x13\n\x0bis_assigned\x18\n \x01(\x08\"\xda\x01\n\x08LirrStop\x12\x15\n\rstop_sequence\x18\x01 \x01(\r\x12\x0c\n\x04stop\x18\x02 \x01(\r\x12\x0f\n\x07\x61rrival\x18\x03 \x01(\x03\x12\x11\n\tdeparture\x18\x04 \x01(\x03\x12\x15\n\rarrival_delay\x18\x05 \x01(\x11\x12\x17\n\x0f\x64\x65parture_delay\x18\x06 \x01(\x11\x12\x1d\n\x15schedule_relationship\x18\x07 \x01(\r\x12\x11\n\tscheduled\x18\x08 \x01(\r\x12\r\n\x05track\x18\t \x01(\r\x12\x14\n\x0ctrain_status\x18\n \x01(\r\"g\n\tLirrTrain\x12\r\n\x05route\x18\x01 \x01(\r\x12\x0f\n\x07trip_id\x18\x02 \x01(\t\x12\"\n\x03stu\x18\x03 \x03(\x0b\x32\x15.mta_monitor.LirrStop\x12\x16\n\x0escheduled_only\x18\x04 \x01(\x08\x42$\n\"com.github.millionsouls.mtamonitor')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'mta_monitor_compact_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  _globals['DESCRIPTOR']._loaded_options = None
+  _globals['DESCRIPTOR']._serialized_options = b'\n\"com.github.millionsouls.mtamonitor'
+  _globals['_COMPACTTRAINS']._serialized_start=43
+  _globals['_COMPACTTRAINS']._serialized_end=270
+  _globals['_ROUTE']._serialized_start=272
+  _globals['_ROUTE']._serialized_end=346
+  _globals['_STOP']._serialized_start=348
+  _globals['_STOP']._serialized_end=385
+  _globals['_NYCTTRAIN']._serialized_start=388
+  _globals['_NYCTTRAIN']._serialized_end=585
+  _globals['_LIRRSTOP']._serialized_start=588
+  _globals['_LIRRSTOP']._serialized_end=806
+  _globals['_LIRRTRAIN']._serialized_start=808
+  _globals['_LIRRTRAIN']._serialized_end=911
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,119 @@
+import sys
+
+'''
+Interned stop, route and color registry shared by NYCT and LIRR.
+
+Every stop, route and (color, text_color) pair gets a dense integer id, names
+are stored once as interned strings. Raw stop ids map straight to their int, and
+NYCT platform ids (101N/101S) map to the int of their parent station at load
+time, so resolving a stop_id from the feed is a single dict lookup.
+
+Raw ids are scoped per agency since NYCT and LIRR reuse the same ids ("101").
+'''
+DEFAULT_COLORS = ("#FFFFFF", "#000000")
+
+class Registry:
+    def __init__(self):
+        # agency -> {raw stop_id: stop int}
+        self.stop_ids = {}
+        self.stop_names = []
+        self.stop_raw_ids = []
+        self.stop_agencies = []
+        # stop int -> (lat, lon), None when stops.txt has no coordinates
+        self.stop_locations = []
+
+        # agency -> {raw route_id: route int}
+        self.route_ids = {}
+        self.route_raw_ids = []
+        self.route_names = []
+        self.route_color_ids = []
+
+        # Color dicts are shared by every response row, do not mutate them
+        self.color_ids = {}
+        self.colors = []
+        self.default_colors = self.color(*DEFAULT_COLORS)
+
+    # --- Stops ---
+    def add_stop(self, agency, stop_id, name, lat=None, lon=None, parent=""):
+        '''
+        Register a stop and return its int. Platforms whose parent is already
+        registered resolve to the parent's int instead of getting their own.
+        '''
+        ids = self.stop_ids.setdefault(agency, {})
+        if parent and parent in ids:
+            ids[stop_id] = ids[parent]
+            return ids[parent]
+        idx = ids.get(stop_id)
+        if idx is None:
+            idx = len(self.stop_names)
+            ids[sys.intern(stop_id)] = idx
+            self.stop_names.append(sys.intern(name))
+            self.stop_raw_ids.append(sys.intern(stop_id))
+            self.stop_agencies.append(agency)
+            self.stop_locations.append((lat, lon) if lat is not None else None)
+        return idx
+
+    def alias_stop(self, agency, alias, stop_id):
+        '''Map another raw id onto an already registered stop'''
+        ids = self.stop_ids.setdefault(agency, {})
+        if stop_id in ids and alias not in ids:
+            ids[sys.intern(alias)] = ids[stop_id]
+
+    def stop(self, agency, stop_id):
+        '''Stop int for a raw stop_id, None when unknown'''
+        return self.stop_ids.get(agency, {}).get(stop_id)
+
+    def stop_name(self, agency, stop_id):
+        idx = self.stop_ids.get(agency, {}).get(stop_id)
+        if idx is None:
+            # Feeds occasionally pad ids, unknown ids are shown as is
+            idx = self.stop_ids.get(agency, {}).get(stop_id.strip())
+            if idx is None:
+                return stop_id
+        return self.stop_names[idx]
+
+    def stations(self, agency=None):
+        '''(stop int, agency, raw stop_id, name, lat, lon) for every parent station'''
+        for idx, name in enumerate(self.stop_names):
+            if agency and self.stop_agencies[idx] != agency:
+                continue
+            location = self.stop_locations[idx] or (None, None)
+            yield idx, self.stop_agencies[idx], self.stop_raw_ids[idx], name, location[0], location[1]
+
+    # --- Routes and colors ---
+    def color(self, color, text_color):
+        key = (color, text_color)
+        idx = self.color_ids.get(key)
+        if idx is None:
+            idx = len(self.colors)
+            self.color_ids[key] = idx
+            self.colors.append({"color": sys.intern(color), "text_color": sys.intern(text_color)})
+        return idx
+
+    def add_route(self, agency, route_id, name=None, color=None, text_color=None):
+        ids = self.route_ids.setdefault(agency, {})
+        idx = ids.get(route_id)
+        if idx is None:
+            idx = len(self.route_raw_ids)
+            ids[sys.intern(route_id)] = idx
+            self.route_raw_ids.append(sys.intern(route_id))
+            self.route_names.append(sys.intern(name) if name else None)
+            self.route_color_ids.append(self.default_colors)
+        if name:
+            self.route_names[idx] = sys.intern(name)
+        if color is not None:
+            self.route_color_ids[idx] = self.color(color, text_color)
+        return idx
+
+    def route(self, agency, route_id):
+        return self.route_ids.get(agency, {}).get(route_id)
+
+    def route_name(self, agency, route_id):
+        idx = self.route_ids.get(agency, {}).get(route_id)
+        return self.route_names[idx] if idx is not None else None
+
+    def route_colors(self, agency, route_id):
+        idx = self.route_ids.get(agency, {}).get(route_id)
+        return self.colors[self.route_color_ids[idx] if idx is not None else self.default_colors]
+
+REGISTRY = Registry()
@@ -0,0 +1,180 @@
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+'''
+Online segment run times learned from successive NYCT snapshots.
+
+A stop is dropped from a trip's stop_time_updates when the train departs it, so
+diffing two snapshots of a trip tells which stops were departed in between. The
+departure time is the last prediction for that stop, clamped to the window
+between the two snapshots. Consecutive departures of one trip give a segment
+run time, which updates streaming statistics keyed by
+    (route_id, direction, from_stop, to_stop, time-of-day bucket)
+
+Each key keeps an EWMA mean/variance and stochastic estimates of the median and
+90th percentile, a fixed handful of floats. The number of keys is capped (least
+recently updated first out) and trips not seen for TRIP_TTL are forgotten, so
+memory stays bounded however long the estimator runs.
+'''
+ALPHA = 0.1
+BUCKET_HOURS = 2
+QUANTILES = (0.5, 0.9)
+MIN_SAMPLES = 5
+# Segment times outside this range are feed glitches, not run times
+MAX_SEGMENT = 30 * 60
+TRIP_TTL = 30 * 60
+MAX_SEGMENTS = 200000
+# Time of day buckets follow service time, not the server's clock
+TIMEZONE = ZoneInfo("America/New_York")
+
+def bucket(ts):
+    return datetime.fromtimestamp(ts, TIMEZONE).hour // BUCKET_HOURS
+
+class SegmentStats:
+    __slots__ = ("count", "mean", "var", "quantiles")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.quantiles = [0.0] * len(QUANTILES)
+
+    def update(self, x, alpha=ALPHA):
+        self.count += 1
+        if self.count == 1:
+            self.mean = float(x)
+            self.quantiles = [float(x)] * len(QUANTILES)
+            return
+        # Plain averaging until there are enough samples for the EWMA to be meaningful
+        a = max(alpha, 1.0 / self.count)
+        diff = x - self.mean
+        incr = a * diff
+        self.mean += incr
+        self.var = (1 - a) * (self.var + diff * incr)
+        step = a * max(math.sqrt(self.var), 1.0)
+        for i, q in enumerate(QUANTILES):
+            self.quantiles[i] += step * (q - (x < self.quantiles[i]))
+
+    @property
+    def std(self):
+        return math.sqrt(self.var)
+
+    def to_dict(self):
+        d = {
+            "samples": self.count,
+            "mean": round(self.mean, 1),
+            "std": round(self.std, 1),
+        }
+        for q, value in zip(QUANTILES, self.quantiles):
+            d["p%d" % round(q * 100)] = round(value, 1)
+        return d
+
+class SegmentEstimator:
+    def __init__(self, max_segments=MAX_SEGMENTS, trip_ttl=TRIP_TTL):
+        self.max_segments = max_segments
+        self.trip_ttl = trip_ttl
+        self.segments = OrderedDict()
+        # trip_id -> [last seen, ((stop_id, predicted departure), ...), last departed stop, its departure time]
+        self.trips = {}
+        self.last_expiry = 0
+        # The feed refresher feeds and request threads read the estimator concurrently
+        self.lock = threading.Lock()
+
+    def update(self, trips, timestamp):
+        '''
+        Feed one snapshot (a full feed, one sub-feed or ALL). Trips already seen at
+        this timestamp or later are skipped, so the same snapshot can be fed twice.
+        Returns the number of segment observations.
+        '''
+        with self.lock:
+            return self._update(trips, timestamp)
+
+    def _update(self, trips, timestamp):
+        observed = 0
+        for trip in trips:
+            state = self.trips.get(trip.id)
+            if state is not None and timestamp <= state[0]:
+                continue
+            stops = tuple((stu.stop_id, stu.departure or stu.arrival) for stu in trip.stop_time_updates)
+            if state is None:
+                self.trips[trip.id] = [timestamp, stops, None, None]
+                continue
+            last_seen, previous, last_stop, last_departure = state
+
+            # Stops at the head of the previous snapshot that are gone now were departed
+            current = {stop_id for stop_id, _ in stops}
+            route_id = trip.trip.route_id
+            direction = getattr(trip, "direction", "")
+            for stop_id, predicted in previous:
+                if stop_id in current:
+                    break
+                departed = min(max(predicted or timestamp, last_seen), timestamp)
+                if last_stop is not None:
+                    run = departed - last_departure
+                    if 0 < run <= MAX_SEGMENT:
+                        self._observe((route_id, direction, last_stop, stop_id, bucket(last_departure)), run)
+                        observed += 1
+                last_stop, last_departure = stop_id, departed
+            self.trips[trip.id] = [timestamp, stops, last_stop, last_departure]
+
+        if timestamp - self.last_expiry > 60:
+            self._expire(timestamp)
+        return observed
+
+    def _observe(self, key, run):
+        stats = self.segments.get(key)
+        if stats is None:
+            stats = self.segments[key] = SegmentStats()
+            if len(self.segments) > self.max_segments:
+                self.segments.popitem(last=False)
+        else:
+            self.segments.move_to_end(key)
+        stats.update(run)
+
+    def _expire(self, timestamp):
+        self.last_expiry = timestamp
+        stale = [trip_id for trip_id, state in self.trips.items() if timestamp - state[0] > self.trip_ttl]
+        for trip_id in stale:
+            del self.trips[trip_id]
+
+    def segment(self, route_id, direction, from_stop, to_stop, ts):
+        return self.segments.get((route_id, direction, from_stop, to_stop, bucket(ts)))
+
+    def corrected_etas(self, trip):
+        '''
+        MTA predictions next to learned ones for the remaining stops of a trip. The
+        first stop keeps the MTA prediction, later stops chain learned segment means
+        where there are at least MIN_SAMPLES and fall back to the MTA's own spacing.
+        '''
+        with self.lock:
+            return self._corrected_etas(trip)
+
+    def _corrected_etas(self, trip):
+        route_id = trip.trip.route_id
+        direction = getattr(trip, "direction", "")
+        results = []
+        previous = None
+        corrected = None
+        for stu in trip.stop_time_updates:
+            mta = stu.departure or stu.arrival
+            stats = None
+            if previous is None or mta is None or previous[1] is None:
+                corrected = mta
+            else:
+                stats = self.segment(route_id, direction, previous[0], stu.stop_id, corrected)
+                if stats is not None and stats.count >= MIN_SAMPLES:
+                    corrected = corrected + int(round(stats.mean))
+                else:
+                    corrected = corrected + (mta - previous[1])
+            results.append({
+                "stop_id": stu.stop_id,
+                "stop_name": stu.stop_name,
+                "mta_eta": mta,
+                "corrected_eta": corrected,
+                "samples": stats.count if stats is not None else 0,
+            })
+            previous = (stu.stop_id, mta)
+        return results
@@ -0,0 +1,260 @@
+import json
+import threading
+import msgpack
+from collections import OrderedDict
+import proto.mta_monitor_compact_pb2 as compact_pb2
+
+'''
+Binary encodings of the /api/*/trains responses for machine consumers.
+
+The JSON rows built by app.py are the canonical data. They are encoded as
+- application/json        the same body jsonify produces
+- application/msgpack     the same rows, as MessagePack
+- application/x-protobuf  proto/mta-monitor-compact.proto, with stop, route and
+                          other repeated strings stored once in a dictionary table
+
+Encoded bodies are cached per feed snapshot (system, line, header timestamps),
+so repeated polls between two feed updates are served without re-encoding.
+'''
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+PROTOBUF = "application/x-protobuf"
+MIMETYPES = [JSON, MSGPACK, PROTOBUF]
+FORMATS = {
+    "json": JSON,
+    "msgpack": MSGPACK,
+    "protobuf": PROTOBUF,
+    "pb": PROTOBUF,
+}
+
+def negotiate(req):
+    # ?format= wins over the Accept header, anything unknown falls back to JSON
+    fmt = req.args.get("format", "").lower()
+    if fmt in FORMATS:
+        return FORMATS[fmt]
+    return req.accept_mimetypes.best_match(MIMETYPES, default=JSON) or JSON
+
+# "HH:MM:SS" -> seconds since midnight, None for empty strings
+def to_seconds(hms):
+    if not hms:
+        return None
+    try:
+        h, m, s = hms.split(":")
+        return int(h) * 3600 + int(m) * 60 + int(s)
+    except ValueError:
+        return None
+
+def from_seconds(seconds):
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+class StringTable:
+    def __init__(self):
+        self.strings = [""]
+        self.index = {"": 0}
+
+    def ref(self, value):
+        if value is None:
+            return 0
+        value = str(value)
+        idx = self.index.get(value)
+        if idx is None:
+            idx = len(self.strings)
+            self.index[value] = idx
+            self.strings.append(value)
+        return idx
+
+class CompactEncoder:
+    def __init__(self, system, timestamp=0):
+        self.msg = compact_pb2.CompactTrains()
+        self.msg.system = system
+        self.msg.timestamp = timestamp or 0
+        self.strings = StringTable()
+        self.routes = {}
+        self.stops = {}
+
+    def route(self, route_id, name, color, text_color):
+        key = (route_id, name, color, text_color)
+        idx = self.routes.get(key)
+        if idx is None:
+            idx = len(self.routes)
+            self.routes[key] = idx
+            r = self.msg.routes.add()
+            r.route_id = self.strings.ref(route_id)
+            r.name = self.strings.ref(name)
+            r.color = self.strings.ref(color)
+            r.text_color = self.strings.ref(text_color)
+        return idx
+
+    def stop(self, stop_id, name):
+        key = (stop_id, name)
+        idx = self.stops.get(key)
+        if idx is None:
+            idx = len(self.stops)
+            self.stops[key] = idx
+            s = self.msg.stops.add()
+            s.stop_id = self.strings.ref(stop_id)
+            s.name = self.strings.ref(name)
+        return idx
+
+    def add_nyct(self, row):
+        t = self.msg.nyct_trains.add()
+        t.route = self.route(row.get("route_id"), row.get("route_long_name"),
+                             row.get("route_color"), row.get("route_text_color"))
+        t.trip_id = row.get("trip_id") or ""
+        if row.get("train_id"):
+            t.train_id = row["train_id"]
+        t.trip_name = self.strings.ref(row.get("trip_name"))
+        t.direction = self.strings.ref(row.get("direction"))
+        t.next_stop = self.stop(row.get("next_stop"), row.get("next_stop_name"))
+        departure = to_seconds(row.get("departure"))
+        if departure is not None:
+            t.departure = departure
+        arrival = to_seconds(row.get("arrival"))
+        if arrival is not None:
+            t.arrival = arrival
+        t.actual_track = self.strings.ref(row.get("actual_track"))
+        t.is_assigned = bool(row.get("is_assigned"))
+
+    def add_lirr(self, row):
+        t = self.msg.lirr_trains.add()
+        t.route = self.route(None, row.get("route_name"),
+                             row.get("route_color"), row.get("route_text_color"))
+        t.trip_id = row.get("trip_id") or ""
+        if row.get("scheduled_only"):
+            t.scheduled_only = True
+        for stop in row.get("stu", []):
+            s = t.stu.add()
+            if stop.get("stop_sequence") is not None:
+                s.stop_sequence = stop["stop_sequence"]
+            s.stop = self.stop(stop.get("stop_id"), stop.get("stop_name"))
+            if stop.get("arrival") is not None:
+                s.arrival = stop["arrival"]
+            if stop.get("departure") is not None:
+                s.departure = stop["departure"]
+            s.arrival_delay = stop.get("adelay") or 0
+            s.departure_delay = stop.get("ddelay") or 0
+            s.schedule_relationship = stop.get("schedule_relationship") or 0
+            s.scheduled = self.strings.ref(stop.get("scheduled"))
+            s.track = self.strings.ref(stop.get("track"))
+            s.train_status = self.strings.ref(stop.get("train_status"))
+
+    def encode(self):
+        self.msg.strings.extend(self.strings.strings)
+        return self.msg.SerializeToString()
+
+def encode_json(system, rows, timestamp=0):
+    return json.dumps(rows, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+def encode_msgpack(system, rows, timestamp=0):
+    return msgpack.packb(rows, use_bin_type=True)
+
+def encode_protobuf(system, rows, timestamp=0):
+    encoder = CompactEncoder(system, timestamp)
+    add = encoder.add_nyct if system == "nyct" else encoder.add_lirr
+    for row in rows:
+        add(row)
+    return encoder.encode()
+
+ENCODERS = {
+    JSON: encode_json,
+    MSGPACK: encode_msgpack,
+    PROTOBUF: encode_protobuf,
+}
+
+# Inverse of encode_protobuf, mostly useful for consumers and for checking round trips
+def decode_protobuf(data):
+    msg = compact_pb2.CompactTrains()
+    msg.ParseFromString(data)
+    strings = msg.strings
+    routes = [(strings[r.route_id], strings[r.name], strings[r.color], strings[r.text_color]) for r in msg.routes]
+    stops = [(strings[s.stop_id], strings[s.name]) for s in msg.stops]
+
+    rows = []
+    for t in msg.nyct_trains:
+        route_id, _, color, text_color = routes[t.route]
+        stop_id, stop_name = stops[t.next_stop]
+        rows.append({
+            "route_id": route_id,
+            "route_color": color,
+            "route_text_color": text_color,
+            "trip_name": strings[t.trip_name],
+            "trip_id": t.trip_id,
+            "train_id": t.train_id,
+            "direction": strings[t.direction],
+            "next_stop": stop_id,
+            "next_stop_name": stop_name,
+            "departure": from_seconds(t.departure) if t.HasField("departure") else "",
+            "arrival": from_seconds(t.arrival) if t.HasField("arrival") else "",
+            "actual_track": strings[t.actual_track],
+            "is_assigned": t.is_assigned,
+        })
+    for t in msg.lirr_trains:
+        _, name, color, text_color = routes[t.route]
+        stu = []
+        for s in t.stu:
+            stop_id, stop_name = stops[s.stop]
+            stu.append({
+                "stop_sequence": s.stop_sequence if s.HasField("stop_sequence") else None,
+                "stop_id": stop_id,
+                "stop_name": stop_name,
+                "arrival": s.arrival if s.HasField("arrival") else None,
+                "adelay": s.arrival_delay,
+                "ddelay": s.departure_delay,
+                "departure": s.departure if s.HasField("departure") else None,
+                "schedule_relationship": s.schedule_relationship,
+                "scheduled": strings[s.scheduled],
+                "track": strings[s.track],
+                "train_status": strings[s.train_status],
+            })
+        row = {
+            "route_name": name,
+            "route_color": color,
+            "route_text_color": text_color,
+            "trip_id": t.trip_id,
+        }
+        if t.scheduled_only:
+            row["scheduled_only"] = True
+        if stu:
+            row["stu"] = stu
+        rows.append(row)
+    return msg.system, msg.timestamp, rows
+
+class SnapshotCache:
+    '''
+    Rows and encoded bodies per feed snapshot. A snapshot is identified by
+    (system, line, header timestamps), a new feed timestamp means a new entry.
+    Feeds without a timestamp are never cached. Only the most recent
+    `maxsize` snapshots are kept.
+    '''
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        # Request threads share the cache, rows are built outside the lock
+        self.lock = threading.Lock()
+
+    def _entry(self, key, build_rows):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+                return entry
+        entry = {"rows": build_rows()}
+        if key[2]:
+            with self.lock:
+                # Another thread may have built the same snapshot meanwhile, keep the first
+                entry = self.entries.pop(key, entry)
+                self.entries[key] = entry
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return entry
+
+    def rows(self, system, line, timestamps, build_rows):
+        return self._entry((system, line, tuple(timestamps)), build_rows)["rows"]
+
+    def encode(self, system, line, timestamps, mimetype, build_rows):
+        entry = self._entry((system, line, tuple(timestamps)), build_rows)
+        body = entry.get(mimetype)
+        if body is None:
+            body = ENCODERS[mimetype](system, entry["rows"], max(timestamps, default=0))
+            entry[mimetype] = body
+        return body
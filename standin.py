@@ -0,0 +1,522 @@
+import os
+import csv
+import gc
+import sys
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, urlsplit
+import proto.gtfs_realtime_pb2 as gtfs_realtime_pb2
+import proto.gtfs_realtime_NYCT_pb2 as gtfs_realtime_nyct_pb2
+import proto.gtfs_realtime_lirr_pb2 as gtfs_realtime_lirr_pb2
+
+'''
+Local stand-in for the MTA realtime endpoints, for load and soak testing.
+
+Serves every NYCT sub-feed in nyct_refs.FEED_URLS and the LIRR feed at the same
+paths as the MTA, generated from the static GTFS in data/. Trips run along
+their route's stops, drift late or early, drop stops as they depart and are
+replaced by new trips, so successive FeedMessages evolve like the real ones,
+with the NYCT (train_id, direction, is_assigned, tracks) and LIRR (track,
+trainStatus) extensions filled in. Each feed regenerates on its own clock.
+
+    python standin.py serve --scale 10 --update-interval 5 --fault-rate 0.02
+    MTA_FEED_BASE=http://127.0.0.1:8765 MTA_SKIP_UPDATES=1 python app.py
+
+Faults, each `--fault-rate` of the time: 500/503 errors, an HTML error page,
+an empty body, a truncated FeedMessage or a slow response.
+
+Soak mode runs the stand-in and the Flask app in one process, requests every
+endpoint in a loop and reports RSS, live object counts, the size of the
+module-level caches and latency percentiles every `--report` seconds
+
+    python standin.py soak --scale 10 --update-interval 2 --duration 2h
+'''
+NYCT_TRIPS_PER_ROUTE = 20
+LIRR_TRIPS_PER_ROUTE = 10
+FAULTS = ("error", "unavailable", "html", "empty", "truncated", "slow")
+# Leading characters of the NYCT stop ids each route runs along, in stop id order
+NYCT_PREFIXES = {
+    "1": ("1",), "2": ("2",), "3": ("2", "3"), "4": ("4",), "5": ("5", "2"), "6": ("6",), "7": ("7",),
+    "S": ("9",), "A": ("A",), "C": ("A",), "E": ("F", "G0", "A"), "SR": ("H",),
+    "B": ("D", "A"), "D": ("D",), "F": ("F",), "M": ("M", "G"), "SF": ("S0",), "G": ("G",),
+    "J": ("J", "M"), "Z": ("J",), "L": ("L",), "N": ("N", "R"), "Q": ("Q", "D"), "R": ("R",), "W": ("R",),
+    "SIR": ("S1", "S2", "S3"),
+}
+
+def load_nyct_patterns(filepath="data/nyct/stops.txt"):
+    '''route_id -> [(stop_id, code)] for the parent stations along the route'''
+    with open(filepath, newline='', encoding='utf-8') as csvfile:
+        stations = [row for row in csv.DictReader(csvfile) if not row.get("parent_station", "").strip()]
+    stations.sort(key=lambda row: row["stop_id"])
+    patterns = {}
+    for route_id, prefixes in NYCT_PREFIXES.items():
+        stops = [(row["stop_id"].strip(), station_code(row["stop_name"]))
+                 for row in stations if row["stop_id"].startswith(prefixes)]
+        patterns[route_id] = stops if len(stops) > 1 else [
+            (row["stop_id"].strip(), station_code(row["stop_name"])) for row in stations[:10]]
+    return patterns
+
+def load_lirr_patterns(filepath="data/lirr/stop_times.txt", trips_path="data/lirr/trips.txt", per_route=20):
+    '''route_id -> up to `per_route` distinct [(stop_id, seconds from first stop)] from the timetable'''
+    routes = {}
+    with open(trips_path, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            routes[row["trip_id"]] = (row["route_id"], row["direction_id"])
+    trips = {}
+    with open(filepath, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            h, m, s = row["departure_time"].split(":")
+            trips.setdefault(row["trip_id"], []).append(
+                (int(row["stop_sequence"]), row["stop_id"], int(h) * 3600 + int(m) * 60 + int(s)))
+    patterns = {}
+    for trip_id, stops in trips.items():
+        if trip_id not in routes or len(stops) < 2:
+            continue
+        route_id, direction_id = routes[trip_id]
+        stops.sort()
+        pattern = (int(direction_id or 0), tuple((stop_id, t - stops[0][2]) for _, stop_id, t in stops))
+        known = patterns.setdefault(route_id, [])
+        if len(known) < per_route and pattern not in known:
+            known.append(pattern)
+    return patterns
+
+def station_code(name):
+    letters = [c for c in name.upper() if c.isalnum()]
+    return "".join(letters[:3]).ljust(3, "X")
+
+class SimTrip:
+    __slots__ = ("trip_id", "route_id", "direction", "train_id", "start", "stops", "next", "delay", "track")
+
+    def __init__(self, trip_id, route_id, direction, train_id, start, stops, track):
+        self.trip_id = trip_id
+        self.route_id = route_id
+        self.direction = direction
+        self.train_id = train_id
+        self.start = start
+        # [(stop_id, scheduled departure)]
+        self.stops = stops
+        self.next = 0
+        self.delay = 0
+        self.track = track
+
+class FeedSimulator:
+    '''
+    One evolving feed. advance(now) moves every trip along, drops departed
+    stops, retires finished trips and starts new ones to keep `trips_per_route`
+    trips per route. message(now) builds the FeedMessage for the current state.
+    '''
+    def __init__(self, system, routes, patterns, trips_per_route, update_interval, rng):
+        self.system = system
+        self.routes = [route_id for route_id in routes if patterns.get(route_id)]
+        self.patterns = patterns
+        self.trips_per_route = trips_per_route
+        self.update_interval = update_interval
+        self.rng = rng
+        self.trips = {route_id: [] for route_id in self.routes}
+        self.created = 0
+        self.timestamp = 0
+        self.body = b""
+        self.lock = threading.Lock()
+
+    def snapshot(self, now):
+        '''Serialized FeedMessage, regenerated when update_interval has passed'''
+        with self.lock:
+            if now - self.timestamp >= self.update_interval:
+                self.advance(now)
+                self.body = self.message(now).SerializeToString()
+                self.timestamp = now
+            return self.body
+
+    def advance(self, now):
+        for route_id, trips in self.trips.items():
+            running = []
+            for trip in trips:
+                # Delays drift, trains mostly lose time
+                trip.delay = max(-60, trip.delay + self.rng.randint(-20, 30))
+                while trip.next < len(trip.stops) and trip.stops[trip.next][1] + trip.delay < now:
+                    trip.next += 1
+                if trip.next < len(trip.stops):
+                    running.append(trip)
+            while len(running) < self.trips_per_route:
+                running.append(self.new_trip(route_id, now, len(running)))
+            self.trips[route_id] = running
+
+    def new_trip(self, route_id, now, slot):
+        # Spread the first trips over the route so a fresh feed looks like a running service
+        self.created += 1
+        n = self.created
+        if self.timestamp:
+            start = now + self.rng.randint(0, 600)
+        else:
+            start = now - self.rng.randint(0, 3600) + slot * 60
+        if self.system == "nyct":
+            stations = self.patterns[route_id]
+            direction = self.rng.choice(("NORTH", "SOUTH"))
+            if direction == "NORTH":
+                stations = stations[::-1]
+            suffix = direction[0]
+            stops = []
+            t = start
+            for stop_id, _ in stations:
+                stops.append((stop_id + suffix, t))
+                # Same segment always takes about the same time
+                t += 75 + hash((route_id, stop_id)) % 90
+            local = start % 86400
+            designator = self.rng.choices("0=/$", weights=(90, 4, 3, 3))[0]
+            train_id = "%s%s %02d%02d%s %s/%s" % (designator, route_id, local // 3600, local % 3600 // 60,
+                                                 "+" if local % 60 >= 30 else " ", stations[0][1], stations[-1][1])
+            trip_id = "%06d_%s..%s%dX%d" % (local * 100 // 60, route_id, suffix, n % 100, n)
+            return SimTrip(trip_id, route_id, direction, train_id, start, stops, self.rng.choice("1234"))
+
+        direction, pattern = self.rng.choice(self.patterns[route_id])
+        stops = [(stop_id, start + offset) for stop_id, offset in pattern]
+        return SimTrip("SIM%d_%s" % (n, route_id), route_id, direction, "", start, stops,
+                       str(self.rng.randint(1, 21)))
+
+    def message(self, now):
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.header.gtfs_realtime_version = "1.0"
+        feed.header.incrementality = gtfs_realtime_pb2.FeedHeader.FULL_DATASET
+        feed.header.timestamp = int(now)
+        if self.system == "nyct":
+            header = feed.header.Extensions[gtfs_realtime_nyct_pb2.nyct_feed_header]
+            header.nyct_subway_version = "1.0"
+            for route_id in self.routes:
+                period = header.trip_replacement_period.add()
+                period.route_id = route_id
+                period.replacement_period.end = int(now) + 1800
+
+        for trips in self.trips.values():
+            for trip in trips:
+                entity = feed.entity.add()
+                entity.id = trip.trip_id
+                update = entity.trip_update
+                update.trip.trip_id = trip.trip_id
+                update.trip.route_id = trip.route_id
+                update.trip.start_date = time.strftime("%Y%m%d", time.localtime(trip.start))
+                if self.system == "nyct":
+                    self._nyct_trip(update, trip, now)
+                else:
+                    self._lirr_trip(feed, update, trip, now)
+        return feed
+
+    def _nyct_trip(self, update, trip, now):
+        nyct_trip = update.trip.Extensions[gtfs_realtime_nyct_pb2.nyct_trip_descriptor]
+        nyct_trip.train_id = trip.train_id
+        nyct_trip.is_assigned = trip.start - now < 600
+        nyct_trip.direction = gtfs_realtime_nyct_pb2.NyctTripDescriptor.Direction.Value(trip.direction)
+        for i in range(trip.next, len(trip.stops)):
+            stop_id, t = trip.stops[i]
+            stu = update.stop_time_update.add()
+            stu.stop_id = stop_id
+            stu.arrival.time = int(t + trip.delay - 30)
+            stu.departure.time = int(t + trip.delay)
+            nyct_stu = stu.Extensions[gtfs_realtime_nyct_pb2.nyct_stop_time_update]
+            nyct_stu.scheduled_track = trip.track
+            if i == trip.next:
+                nyct_stu.actual_track = trip.track
+
+    def _lirr_trip(self, feed, update, trip, now):
+        update.trip.direction_id = trip.direction
+        update.trip.start_time = time.strftime("%H:%M:%S", time.localtime(trip.start))
+        for i in range(trip.next, len(trip.stops)):
+            stop_id, t = trip.stops[i]
+            stu = update.stop_time_update.add()
+            stu.stop_sequence = i + 1
+            stu.stop_id = stop_id
+            stu.arrival.time = int(t + trip.delay)
+            stu.arrival.delay = trip.delay
+            stu.departure.time = int(t + trip.delay)
+            stu.departure.delay = trip.delay
+            lirr_stu = stu.Extensions[gtfs_realtime_lirr_pb2.mta_railroad_stop_time_update]
+            # Tracks are posted shortly before the train arrives
+            if t + trip.delay - now < 900:
+                lirr_stu.track = trip.track
+            lirr_stu.trainStatus = "Late" if trip.delay > 300 else "On Time"
+
+        entity = feed.entity.add()
+        entity.id = "V" + trip.trip_id
+        vehicle = entity.vehicle
+        vehicle.trip.trip_id = trip.trip_id
+        vehicle.trip.route_id = trip.route_id
+        vehicle.stop_id = trip.stops[trip.next][0]
+        vehicle.current_status = gtfs_realtime_pb2.VehiclePosition.IN_TRANSIT_TO
+        vehicle.timestamp = int(now)
+
+class StandinServer:
+    '''
+    Serves one FeedSimulator per MTA path. `speed` runs the feed clock faster
+    than the wall clock, e.g. 60 replays an hour of service per minute.
+    '''
+    def __init__(self, host="127.0.0.1", port=8765, scale=1, update_interval=30, fault_rate=0.0,
+                 slow_seconds=2.0, speed=1.0, seed=None):
+        from nyct_refs import FEED_URLS
+        from lirr_refs import FEED_URL
+
+        self.rng = random.Random(seed)
+        self.fault_rate = fault_rate
+        self.slow_seconds = slow_seconds
+        self.speed = speed
+        self.started = time.time()
+        self.requests = 0
+        self.faults = dict.fromkeys(FAULTS, 0)
+
+        nyct = load_nyct_patterns()
+        lirr = load_lirr_patterns()
+        self.feeds = {}
+        for i, (routes, url) in enumerate(FEED_URLS):
+            # Stagger the sub-feeds so they do not all update at once
+            interval = update_interval * (1 + 0.1 * i)
+            self.feeds[unquote(urlsplit(url).path)] = FeedSimulator(
+                "nyct", routes, nyct, NYCT_TRIPS_PER_ROUTE * scale, interval, random.Random(self.rng.random()))
+        self.feeds[unquote(urlsplit(FEED_URL).path)] = FeedSimulator(
+            "lirr", sorted(lirr), lirr, LIRR_TRIPS_PER_ROUTE * scale, update_interval, random.Random(self.rng.random()))
+
+        self.httpd = ThreadingHTTPServer((host, port), StandinHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.standin = self
+        self.base_url = "http://%s:%d" % self.httpd.server_address[:2]
+
+    def now(self):
+        return self.started + (time.time() - self.started) * self.speed
+
+    def fault(self):
+        if self.fault_rate and self.rng.random() < self.fault_rate:
+            kind = self.rng.choice(FAULTS)
+            self.faults[kind] += 1
+            return kind
+        return None
+
+    def start(self):
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        standin = self.server.standin
+        standin.requests += 1
+        feed = standin.feeds.get(unquote(urlsplit(self.path).path))
+        if feed is None:
+            return self._send(404, b"Not found", "text/plain")
+        body = feed.snapshot(standin.now())
+
+        fault = standin.fault()
+        if fault == "error":
+            return self._send(500, b"Internal Server Error", "text/plain")
+        if fault == "unavailable":
+            return self._send(503, b"Service Unavailable", "text/plain")
+        if fault == "html":
+            return self._send(200, b"<html><body>Upstream timeout</body></html>", "text/html")
+        if fault == "empty":
+            body = b""
+        elif fault == "truncated":
+            body = body[:len(body) // 2]
+        elif fault == "slow":
+            time.sleep(standin.slow_seconds)
+        self._send(200, body, "application/x-protobuf")
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# --- Soak test ---
+SOAK_ENDPOINTS = [
+    "/api/nyct/trains?line=ALL",
+    "/api/nyct/trains?line=A",
+    "/api/nyct/trains?line=1&format=msgpack",
+    "/api/nyct/trains?line=N&trip_type=scheduled",
+    "/api/nyct/headways?line=A",
+    "/api/nyct/etas?line=1",
+    "/api/lirr/trains?line=ALL",
+    "/api/lirr/trains?line=ALL&format=protobuf",
+    "/api/lirr/departures?stop=237&minutes=60",
+    "/api/stops/nearby?lat=40.7527&lon=-73.9772&k=5&arrivals=1",
+    "/api/stops/search?q=%s",
+]
+SEARCH_TERMS = ["penn", "times sq", "jamaica", "atlantic", "court sq", "fulton", "flushing", "babylon"]
+
+def rss_mb():
+    '''Current resident set size, peak RSS where /proc is not available'''
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def tracked_sizes(monitor):
+    '''Entry counts of the module-level dicts and caches that live as long as the app'''
+    import nyct_refs
+    import lirr_refs
+    from registry import REGISTRY
+    return {
+        "nyct TRIPS": len(nyct_refs.TRIPS),
+        "TRAIN_IDS": len(nyct_refs.TRAIN_IDS),
+        "lirr SCHEDULE": len(lirr_refs.SCHEDULE),
+        "registry stops": len(REGISTRY.stop_names),
+        "registry routes": len(REGISTRY.route_raw_ids),
+        "snapshots": len(monitor.SNAPSHOTS.entries),
+        "segments": len(monitor.SEGMENTS.segments),
+        "segment trips": len(monitor.SEGMENTS.trips),
+        "search cache": monitor.STOP_SEARCH.search.cache_info().currsize,
+        "subscription trips": sum(len(trips) for trips in monitor.SUBSCRIPTIONS.trips.values()),
+    }
+
+def percentiles(samples, qs=(50, 95, 99)):
+    if not samples:
+        return [0.0] * len(qs)
+    ordered = sorted(samples)
+    return [ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] for q in qs]
+
+def parse_duration(text):
+    '''"90", "90s", "30m", "6h" or "2d" in seconds'''
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if text[-1:] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+def growth_per_hour(samples):
+    '''Least squares slope of (seconds, value) samples, per hour'''
+    if len(samples) < 2:
+        return 0.0
+    n = len(samples)
+    mean_t = sum(t for t, _ in samples) / n
+    mean_v = sum(v for _, v in samples) / n
+    var = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not var:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in samples) / var * 3600
+
+def soak(server, duration, report=60, reservoir=10000):
+    import nyct_refs
+    if nyct_refs.FEED_BASE != server.base_url:
+        raise RuntimeError(f"Set MTA_FEED_BASE={server.base_url} before nyct_refs is imported")
+    os.environ.setdefault("MTA_SKIP_UPDATES", "1")
+    server.start()
+    import app as monitor
+
+    client = monitor.app.test_client()
+    rng = random.Random(0)
+    latencies = {endpoint: [] for endpoint in SOAK_ENDPOINTS}
+    overall = {endpoint: [] for endpoint in SOAK_ENDPOINTS}
+    seen = dict.fromkeys(SOAK_ENDPOINTS, 0)
+    statuses = {}
+    history = []
+    started = time.time()
+    next_report = started + report
+    rounds = 0
+
+    def sample():
+        gc.collect()
+        elapsed = time.time() - started
+        history.append((elapsed, rss_mb(), len(gc.get_objects()), tracked_sizes(monitor)))
+        _, rss, objects, sizes = history[-1]
+        print(f"[{elapsed / 60:7.1f} min] rounds={rounds} rss={rss:.1f}MB objects={objects} "
+              + " ".join(f"{name}={count}" for name, count in sizes.items()))
+        for endpoint, samples in latencies.items():
+            p50, p95, p99 = percentiles(samples)
+            print(f"    {endpoint:<60} n={len(samples):<5} p50={p50:7.1f}ms p95={p95:7.1f}ms p99={p99:7.1f}ms")
+            samples.clear()
+
+    print(f"Soaking against {server.base_url} for {duration:.0f}s")
+    sample()
+    while time.time() - started < duration:
+        for endpoint in SOAK_ENDPOINTS:
+            if "%s" in endpoint:
+                url = endpoint % rng.choice(SEARCH_TERMS)
+            else:
+                url = endpoint
+            t = time.perf_counter()
+            try:
+                status = client.get(url).status_code
+            except Exception as e:
+                status = type(e).__name__
+            ms = (time.perf_counter() - t) * 1000
+            statuses[status] = statuses.get(status, 0) + 1
+            latencies[endpoint].append(ms)
+            # Reservoir sample so whole-run percentiles stay bounded over days
+            seen[endpoint] += 1
+            if len(overall[endpoint]) < reservoir:
+                overall[endpoint].append(ms)
+            else:
+                slot = rng.randrange(seen[endpoint])
+                if slot < reservoir:
+                    overall[endpoint][slot] = ms
+        rounds += 1
+        if time.time() >= next_report:
+            sample()
+            next_report += report
+    sample()
+    summarize(history, overall, statuses, server)
+    return history
+
+def summarize(history, overall, statuses, server):
+    # Skip the first half as warm up, caches fill and then should stay flat
+    settled = history[len(history) // 2:]
+    first, last = history[0], history[-1]
+    print("\nSummary")
+    print(f"  rss      {first[1]:.1f}MB -> {last[1]:.1f}MB, "
+          f"{growth_per_hour([(t, rss) for t, rss, _, _ in settled]):+.2f}MB/h after warm up")
+    print(f"  objects  {first[2]} -> {last[2]}, "
+          f"{growth_per_hour([(t, objects) for t, _, objects, _ in settled]):+.0f}/h after warm up")
+    for name in last[3]:
+        slope = growth_per_hour([(t, sizes[name]) for t, _, _, sizes in settled])
+        flag = "  <-- still growing" if slope > 0 and len(settled) > 2 and \
+            all(a[3][name] <= b[3][name] for a, b in zip(settled, settled[1:])) and \
+            settled[-1][3][name] > settled[0][3][name] else ""
+        print(f"  {name:<20} {first[3][name]} -> {last[3][name]} ({slope:+.0f}/h){flag}")
+    print("  responses " + " ".join(f"{status}={count}" for status, count in sorted(statuses.items(), key=str)))
+    print(f"  stand-in requests={server.requests} faults " + " ".join(f"{k}={v}" for k, v in server.faults.items()))
+    for endpoint, samples in overall.items():
+        p50, p95, p99 = percentiles(samples)
+        print(f"  {endpoint:<60} p50={p50:7.1f}ms p95={p95:7.1f}ms p99={p99:7.1f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic stand-in for the MTA GTFS-RT endpoints")
+    parser.add_argument("mode", choices=["serve", "soak"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scale", type=int, default=1, help="multiplier on today's trip counts")
+    parser.add_argument("--update-interval", type=float, default=30, help="seconds between feed updates")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="fraction of responses that fail")
+    parser.add_argument("--slow-seconds", type=float, default=2.0)
+    parser.add_argument("--speed", type=float, default=1.0, help="feed clock speed relative to wall time")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--duration", default="10m", help="soak duration, e.g. 600, 30m, 6h, 2d")
+    parser.add_argument("--report", type=float, default=60, help="seconds between soak reports")
+    args = parser.parse_args()
+
+    if args.mode == "soak":
+        # The feed URLs are read once, when nyct_refs and lirr_refs are first imported
+        os.environ["MTA_FEED_BASE"] = "http://%s:%d" % (args.host, args.port)
+    server = StandinServer(args.host, args.port, args.scale, args.update_interval, args.fault_rate,
+                           args.slow_seconds, args.speed, args.seed)
+    if args.mode == "serve":
+        print(f"Serving {len(server.feeds)} feeds at {server.base_url}")
+        print(f"Run the app with MTA_FEED_BASE={server.base_url} MTA_SKIP_UPDATES=1")
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        soak(server, parse_duration(args.duration), args.report)
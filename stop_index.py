@@ -0,0 +1,146 @@
+import heapq
+import math
+from registry import REGISTRY
+
+'''
+Nearest-station lookups over the stops.txt coordinates of both agencies.
+
+Platform stops (101N/101S) are collapsed into their parent station, so every
+station is indexed once. Coordinates are projected onto a flat plane in meters
+around the center of the city, which is plenty for ranking at this scale, and
+stored in a 2-d KD-tree. Reported distances use the haversine formula. A k-nearest lookup visits O(log n) nodes on
+average instead of scanning every stop.
+'''
+EARTH_RADIUS = 6371008.8
+ORIGIN_LAT = 40.75
+
+def project(lat, lon):
+    x = math.radians(lon) * math.cos(math.radians(ORIGIN_LAT)) * EARTH_RADIUS
+    y = math.radians(lat) * EARTH_RADIUS
+    return x, y
+
+def haversine(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+class Station:
+    __slots__ = ("agency", "stop_id", "stop_name", "lat", "lon", "x", "y")
+
+    def __init__(self, agency, stop_id, stop_name, lat, lon):
+        self.agency = agency
+        self.stop_id = stop_id
+        self.stop_name = stop_name
+        self.lat = lat
+        self.lon = lon
+        self.x, self.y = project(lat, lon)
+
+    def to_dict(self):
+        return {
+            "agency": self.agency,
+            "stop_id": self.stop_id,
+            "stop_name": self.stop_name,
+            "lat": self.lat,
+            "lon": self.lon,
+        }
+
+class KDTree:
+    # Nodes are [station, axis, left, right]
+    def __init__(self, stations):
+        self.size = len(stations)
+        self.root = self._build(list(stations), 0)
+
+    def _build(self, stations, axis):
+        if not stations:
+            return None
+        stations.sort(key=lambda s: s.x if axis == 0 else s.y)
+        mid = len(stations) // 2
+        return [
+            stations[mid],
+            axis,
+            self._build(stations[:mid], 1 - axis),
+            self._build(stations[mid + 1:], 1 - axis),
+        ]
+
+    def nearest(self, x, y, k=1, max_distance=None):
+        if k < 1:
+            return []
+        # Max-heap of (-distance^2, counter, station) holding the best k so far
+        best = []
+        bound = max_distance * max_distance if max_distance is not None else math.inf
+        counter = 0
+        # (node, squared distance from the query to the plane that led to it)
+        stack = [(self.root, 0.0)]
+        while stack:
+            node, plane = stack.pop()
+            if node is None:
+                continue
+            # Skip subtrees whose splitting plane is further than the current worst
+            if plane >= (-best[0][0] if len(best) == k else bound):
+                continue
+            station, axis, left, right = node
+            dx = x - station.x
+            dy = y - station.y
+            d2 = dx * dx + dy * dy
+            if d2 < (-best[0][0] if len(best) == k else bound):
+                counter += 1
+                if len(best) == k:
+                    heapq.heapreplace(best, (-d2, counter, station))
+                else:
+                    heapq.heappush(best, (-d2, counter, station))
+            diff = dx if axis == 0 else dy
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append((far, diff * diff))
+            stack.append((near, 0.0))
+        return [station for _, _, station in sorted(best, key=lambda b: -b[0])]
+
+class StopIndex:
+    def __init__(self, stations):
+        self.stations = {(s.agency, s.stop_id): s for s in stations}
+        self.tree = KDTree(stations)
+
+    @classmethod
+    def from_static(cls):
+        '''Build from the loaded NYCTStaticData and LIRRStaticData'''
+        stations = []
+        for _, agency, stop_id, name, lat, lon in REGISTRY.stations():
+            if lat is not None:
+                stations.append(Station(agency, stop_id, name, lat, lon))
+        print("Stations indexed for nearby search:", len(stations))
+        return cls(stations)
+
+    def nearby(self, lat, lon, k=5, max_distance=None):
+        x, y = project(lat, lon)
+        results = []
+        for station in self.tree.nearest(x, y, k, max_distance):
+            result = station.to_dict()
+            result["distance_m"] = round(haversine(lat, lon, station.lat, station.lon), 1)
+            results.append(result)
+        return results
+
+def join_arrivals(results, trips, limit=3):
+    '''
+    Attach the next `limit` arrivals to each nearby result. `trips` maps an
+    agency to the trips of its current feed, platform stop ids are matched to
+    their parent station.
+    '''
+    wanted = {REGISTRY.stop(r["agency"], r["stop_id"]): [] for r in results}
+    for agency, agency_trips in trips.items():
+        for trip in agency_trips:
+            for stu in trip.stop_time_updates:
+                arrivals = wanted.get(REGISTRY.stop(agency, stu.stop_id))
+                if arrivals is None:
+                    continue
+                arrivals.append({
+                    "route_id": trip.trip.route_id,
+                    "trip_id": trip.id,
+                    "stop_id": stu.stop_id,
+                    "arrival": stu.arrival,
+                    "departure": stu.departure,
+                })
+    for r in results:
+        arrivals = wanted[REGISTRY.stop(r["agency"], r["stop_id"])]
+        arrivals.sort(key=lambda a: a["arrival"] or a["departure"] or 0)
+        r["arrivals"] = arrivals[:limit]
+    return results
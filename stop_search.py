@@ -0,0 +1,174 @@
+import re
+from collections import Counter
+from functools import lru_cache
+from registry import REGISTRY
+
+'''
+Typeahead search over NYCT and LIRR station names.
+
+Names are normalized (case-folded, punctuation dropped, "Street"/"Avenue"/"42nd"
+style words reduced to "st"/"av"/"42") and indexed twice:
+- a prefix trie over every word, so "penn" or "times sq" match as the user types,
+  a half typed last word like "stre" or "42n" also matches what it can become
+- a trigram index, so misspellings like "atlantc" still find something
+
+The index is built once after the static data is loaded (run_updates only swaps
+static data at startup) and is immutable afterwards, which keeps concurrent
+lookups lock free. Results are ranked exact name > name prefix > word prefixes > trigram similarity.
+'''
+ABBREVIATIONS = {
+    "street": "st",
+    "streets": "sts",
+    "avenue": "av",
+    "ave": "av",
+    "avenues": "avs",
+    "boulevard": "blvd",
+    "parkway": "pkwy",
+    "pky": "pkwy",
+    "square": "sq",
+    "road": "rd",
+    "place": "pl",
+    "heights": "hts",
+    "center": "ctr",
+    "junction": "jct",
+    "highway": "hwy",
+    "terrace": "ter",
+    "east": "e",
+    "west": "w",
+    "north": "n",
+    "south": "s",
+    "and": "&",
+}
+ORDINAL = re.compile(r"^(\d+)(st|nd|rd|th)$")
+# A number followed by the start of an ordinal suffix, "42n" on its way to "42nd"
+PARTIAL_ORDINAL = re.compile(r"^(\d+)(s|n|r|t)$")
+SPLIT = re.compile(r"[^\w&]+")
+
+EXACT = 0
+PREFIX = 1
+WORDS = 2
+FUZZY = 3
+
+def raw_tokens(text):
+    return [token for token in SPLIT.split(text.casefold()) if token]
+
+def normalize_tokens(text):
+    tokens = []
+    for token in raw_tokens(text):
+        match = ORDINAL.match(token)
+        if match:
+            token = match.group(1)
+        tokens.append(ABBREVIATIONS.get(token, token))
+    return tokens
+
+def completions(token):
+    '''Normalized words a partly typed last query word can still turn into'''
+    forms = {token}
+    match = PARTIAL_ORDINAL.match(token)
+    if match:
+        forms.add(match.group(1))
+    forms.update(short for word, short in ABBREVIATIONS.items() if word.startswith(token))
+    return forms
+
+def normalize(text):
+    return " ".join(normalize_tokens(text))
+
+def trigrams(text):
+    padded = "  " + text + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class StopSearch:
+    def __init__(self, stations):
+        # stations: list of (agency, stop_id, stop_name)
+        self.stations = stations
+        self.names = [normalize(name) for _, _, name in stations]
+        self.trie = {}
+        self.grams = {}
+        # normalized word -> names containing it as a whole word
+        self.words = {}
+        for idx, name in enumerate(self.names):
+            for token in set(name.split()):
+                self.words.setdefault(token, set()).add(idx)
+                node = self.trie
+                for char in token:
+                    node = node.setdefault(char, {})
+                    node.setdefault("", set()).add(idx)
+            for gram in trigrams(name):
+                self.grams.setdefault(gram, set()).add(idx)
+        self.gram_counts = [len(trigrams(name)) for name in self.names]
+        self.search = lru_cache(maxsize=4096)(self._search)
+
+    @classmethod
+    def from_static(cls):
+        '''Build from the loaded NYCTStaticData and LIRRStaticData, platforms are skipped'''
+        stations = [(agency, stop_id, name) for _, agency, stop_id, name, _, _ in REGISTRY.stations()]
+        print("Stations indexed for name search:", len(stations))
+        return cls(stations)
+
+    def _prefix(self, token):
+        node = self.trie
+        for char in token:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node.get("", set())
+
+    def _search(self, query, limit=10):
+        tokens = normalize_tokens(query)
+        if not tokens:
+            return ()
+        text = " ".join(tokens)
+
+        ranked = {}
+        # Every query word has to be a prefix of some word of the name. The last
+        # one may be half typed ("stre", "42n"), so whatever it can still become counts too
+        partial = raw_tokens(query)[-1]
+        if query[-1:].isspace():
+            partial = tokens[-1]
+        # Only what was typed is a prefix, abbreviations and ordinals it completes to are whole words
+        whole = (completions(partial) | {tokens[-1]}) - {partial}
+        candidates = None
+        for i, token in enumerate(tokens):
+            if i == len(tokens) - 1:
+                matches = self._prefix(partial).union(*(self.words.get(form, ()) for form in whole))
+            else:
+                matches = self._prefix(token)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                break
+        for idx in candidates or ():
+            name = self.names[idx]
+            words = name.split()
+            if name == text:
+                tier = EXACT
+            elif len(words) >= len(tokens) and words[:len(tokens) - 1] == tokens[:-1] and \
+                    (words[len(tokens) - 1].startswith(partial) or words[len(tokens) - 1] in whole):
+                tier = PREFIX
+            else:
+                tier = WORDS
+            ranked[idx] = (tier, 0.0)
+
+        if len(ranked) < limit:
+            query_grams = trigrams(text)
+            overlap = Counter()
+            for gram in query_grams:
+                for idx in self.grams.get(gram, ()):
+                    overlap[idx] += 1
+            for idx, shared in overlap.items():
+                if idx in ranked:
+                    continue
+                similarity = shared / (len(query_grams) + self.gram_counts[idx] - shared)
+                if similarity >= 0.2:
+                    ranked[idx] = (FUZZY, -similarity)
+
+        order = sorted(ranked, key=lambda idx: (ranked[idx], len(self.names[idx]), self.names[idx]))
+        results = []
+        for idx in order[:limit]:
+            agency, stop_id, name = self.stations[idx]
+            results.append({
+                "agency": agency,
+                "stop_id": stop_id,
+                "stop_name": name,
+                "match": ("exact", "prefix", "words", "fuzzy")[ranked[idx][0]],
+            })
+        return tuple(results)
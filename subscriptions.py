@@ -0,0 +1,340 @@
+import heapq
+import itertools
+import math
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left, insort
+from urllib.parse import urlsplit
+import requests
+
+'''
+Rider subscriptions matched against each new realtime snapshot.
+
+Kinds
+- track     notify once when the track of a trip (at stop_id, or any stop) is posted
+            LIRR track / NYCT actual_track
+- arrival   notify once when the next route_id train at stop_id is within `minutes`
+- trip      notify on every change of a trip's stop times until unsubscribed
+
+Subscriptions are indexed by trip_id and by (system, stop_id, route_id), never
+scanned. Each snapshot is diffed against the previous one per trip, and only the
+subscriptions indexed under changed trips are looked at. Arrival thresholds are
+kept sorted per (stop, route) and each key has one entry in a heap for the time
+its earliest subscriber becomes due, so time passing without a feed change costs
+a heap pop rather than a pass over subscribers.
+'''
+SYSTEMS = ("nyct", "lirr")
+# Hosts webhooks may be delivered to, comma separated in MTA_WEBHOOK_HOSTS
+WEBHOOK_HOSTS = {host.strip() for host in os.environ.get("MTA_WEBHOOK_HOSTS", "localhost,127.0.0.1,::1").split(",")
+                 if host.strip()}
+
+class QueueDelivery:
+    '''
+    Local stand-in for a notification service, events end up in self.queue.
+    When nobody drains it, the oldest events are dropped past `maxsize`.
+    '''
+    def __init__(self, maxsize=10000):
+        self.queue = queue.Queue(maxsize)
+        self.delivered = 0
+        self.dropped = 0
+
+    def deliver(self, event):
+        self.delivered += 1
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+class WebhookPool:
+    '''A fixed set of background threads POSTing events as JSON, shared by every webhook'''
+    def __init__(self, workers=4, timeout=5):
+        self.workers = workers
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def post(self, url, event):
+        if not self.threads:
+            with self.lock:
+                while len(self.threads) < self.workers:
+                    thread = threading.Thread(target=self._run, daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+        self.queue.put((url, event))
+
+    def _run(self):
+        while True:
+            url, event = self.queue.get()
+            try:
+                # No redirects, they could lead off the allowed hosts
+                requests.post(url, json=event, timeout=self.timeout, allow_redirects=False)
+            except Exception as e:
+                print("Failed to deliver notification. Error:", e)
+
+WEBHOOK_POOL = WebhookPool()
+
+def check_webhook(url):
+    '''Webhooks may only point at WEBHOOK_HOSTS, anything else is refused with a ValueError'''
+    if not isinstance(url, str):
+        raise ValueError("webhook must be a URL string")
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or parts.hostname not in WEBHOOK_HOSTS:
+        raise ValueError("webhook must be an http(s) URL on one of: " + ", ".join(sorted(WEBHOOK_HOSTS)))
+    return url
+
+class WebhookDelivery:
+    '''Delivers to a local webhook through the shared WebhookPool'''
+    __slots__ = ("url", "pool")
+
+    def __init__(self, url, pool=None):
+        self.url = check_webhook(url)
+        self.pool = pool or WEBHOOK_POOL
+
+    def deliver(self, event):
+        self.pool.post(self.url, event)
+
+class Subscription:
+    __slots__ = ("id", "kind", "system", "trip_id", "stop_id", "route_id", "threshold", "delivery")
+
+    def __init__(self, id, kind, system, trip_id=None, stop_id=None, route_id=None, minutes=None, delivery=None):
+        self.id = id
+        self.kind = kind
+        self.system = system
+        self.trip_id = trip_id
+        self.stop_id = stop_id
+        self.route_id = route_id
+        self.threshold = int(minutes * 60) if minutes is not None else None
+        self.delivery = delivery
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "system": self.system,
+            "trip_id": self.trip_id,
+            "stop_id": self.stop_id,
+            "route_id": self.route_id,
+            "minutes": self.threshold / 60 if self.threshold is not None else None,
+        }
+
+def trip_state(trip):
+    '''(stop_id, arrival, departure, track) per stop, works for NYCTTrip and LIRRTrip'''
+    return tuple(
+        (stu.stop_id, stu.arrival, stu.departure, getattr(stu, "track", "") or getattr(stu, "actual_track", ""))
+        for stu in trip.stop_time_updates
+    )
+
+class SubscriptionRegistry:
+    def __init__(self, delivery=None):
+        self.delivery = delivery or QueueDelivery()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.subscriptions = {}
+        # (system, trip_id) -> {sub_id: Subscription}, for track and trip subscriptions
+        self.by_trip = {}
+        # (system, stop_id, route_id) -> sorted [(threshold, sub_id)]
+        self.by_stop = {}
+        # Last snapshot per system: trip_id -> (route_id, state)
+        self.trips = {}
+        # (system, stop_id, route_id) -> {trip_id: arrival}
+        self.arrivals = {}
+        # Heap of (due, version, key), entries no longer in self.scheduled are stale
+        self.due = []
+        self.scheduled = {}
+        self.version = itertools.count(1)
+        self.now = None
+
+    def subscribe(self, kind, system, trip_id=None, stop_id=None, route_id=None, minutes=None, delivery=None):
+        if kind in ("track", "trip") and not trip_id:
+            raise ValueError(f"{kind} subscriptions need a trip_id")
+        if kind == "arrival" and not (stop_id and route_id and minutes is not None):
+            raise ValueError("arrival subscriptions need stop_id, route_id and minutes")
+        if kind not in ("track", "trip", "arrival"):
+            raise ValueError(f"Unknown subscription kind: {kind}")
+        if system not in SYSTEMS:
+            raise ValueError("system must be one of " + ", ".join(SYSTEMS))
+        if minutes is not None and not (math.isfinite(minutes) and minutes > 0):
+            raise ValueError("minutes must be a positive number")
+
+        with self.lock:
+            sub = Subscription(next(self.ids), kind, system, trip_id, stop_id, route_id, minutes, delivery)
+            self.subscriptions[sub.id] = sub
+            if kind == "arrival":
+                key = (system, stop_id, route_id)
+                insort(self.by_stop.setdefault(key, []), (sub.threshold, sub.id))
+                self._schedule(key, self.now if self.now is not None else time.time())
+            else:
+                self.by_trip.setdefault((system, trip_id), {})[sub.id] = sub
+                if kind == "track":
+                    # The track may already be posted, later diffs would never show it change
+                    known = self.trips.get(system, {}).get(trip_id)
+                    if known is not None:
+                        self._match_trip(system, trip_id, known[0], (), known[1], only=sub)
+            return sub
+
+    def unsubscribe(self, sub_id):
+        with self.lock:
+            return self._remove(sub_id) is not None
+
+    def _remove(self, sub_id):
+        sub = self.subscriptions.pop(sub_id, None)
+        if sub is None:
+            return None
+        if sub.kind == "arrival":
+            key = (sub.system, sub.stop_id, sub.route_id)
+            entries = self.by_stop.get(key, [])
+            idx = bisect_left(entries, (sub.threshold, sub.id))
+            if idx < len(entries) and entries[idx][1] == sub.id:
+                del entries[idx]
+            if not entries:
+                self.by_stop.pop(key, None)
+        else:
+            subs = self.by_trip.get((sub.system, sub.trip_id), {})
+            subs.pop(sub.id, None)
+            if not subs:
+                self.by_trip.pop((sub.system, sub.trip_id), None)
+        return sub
+
+    def _notify(self, sub, **event):
+        event.update({
+            "subscription_id": sub.id,
+            "kind": sub.kind,
+            "system": sub.system,
+        })
+        (sub.delivery or self.delivery).deliver(event)
+
+    def _schedule(self, key, now):
+        # Due when the next upcoming arrival at key minus the largest threshold is reached
+        self.scheduled.pop(key, None)
+        entries = self.by_stop.get(key)
+        arrivals = self.arrivals.get(key)
+        if not arrivals or not entries:
+            return
+        upcoming = [t for t in arrivals.values() if t >= now]
+        if not upcoming:
+            return
+        entry = (min(upcoming) - entries[-1][0], next(self.version), key)
+        self.scheduled[key] = entry
+        heapq.heappush(self.due, entry)
+        # Rescheduling leaves stale entries behind, rebuild before they dominate the heap
+        if len(self.due) > 2 * len(self.scheduled) + 1024:
+            self.due = list(self.scheduled.values())
+            heapq.heapify(self.due)
+
+    def process(self, system, trips, now=None):
+        '''Match one snapshot of NYCTTrip/LIRRTrip objects, returns the number of changed trips'''
+        now = now if now is not None else time.time()
+        with self.lock:
+            self.now = now
+            previous = self.trips.get(system, {})
+            current = {}
+            changed = []
+            for trip in trips:
+                state = trip_state(trip)
+                route_id = trip.trip.route_id
+                current[trip.id] = (route_id, state)
+                old = previous.get(trip.id)
+                if old is None or old[1] != state:
+                    changed.append((trip.id, route_id, old[1] if old else (), state))
+            for trip_id in previous.keys() - current.keys():
+                route_id, state = previous[trip_id]
+                changed.append((trip_id, route_id, state, ()))
+            self.trips[system] = current
+
+            dirty = set()
+            for trip_id, route_id, old, new in changed:
+                self._match_trip(system, trip_id, route_id, old, new)
+                self._update_arrivals(system, trip_id, route_id, old, new, dirty)
+            for key in dirty:
+                self._schedule(key, now)
+            self._fire_due(now)
+            return len(changed)
+
+    def _match_trip(self, system, trip_id, route_id, old, new, only=None):
+        subs = self.by_trip.get((system, trip_id))
+        if not subs:
+            return
+        old_tracks = {stop_id: track for stop_id, _, _, track in old}
+        for sub in [only] if only is not None else list(subs.values()):
+            if sub.kind == "trip":
+                self._notify(sub, trip_id=trip_id, route_id=route_id, stops=[
+                    {"stop_id": s, "arrival": a, "departure": d, "track": t} for s, a, d, t in new
+                ])
+                if not new:
+                    self._remove(sub.id)
+                continue
+            for stop_id, arrival, departure, track in new:
+                if sub.stop_id and stop_id != sub.stop_id:
+                    continue
+                if track and old_tracks.get(stop_id) != track:
+                    self._notify(sub, trip_id=trip_id, route_id=route_id, stop_id=stop_id, track=track, arrival=arrival)
+                    self._remove(sub.id)
+                    break
+
+    def _update_arrivals(self, system, trip_id, route_id, old, new, dirty):
+        for stop_id, _, _, _ in old:
+            key = (system, stop_id, route_id)
+            arrivals = self.arrivals.get(key)
+            if arrivals is not None:
+                arrivals.pop(trip_id, None)
+                if not arrivals:
+                    del self.arrivals[key]
+                if key in self.by_stop:
+                    dirty.add(key)
+        for stop_id, arrival, departure, _ in new:
+            t = arrival or departure
+            if not t:
+                continue
+            key = (system, stop_id, route_id)
+            self.arrivals.setdefault(key, {})[trip_id] = t
+            if key in self.by_stop:
+                dirty.add(key)
+
+    def _fire_due(self, now):
+        while self.due and self.due[0][0] <= now:
+            entry = heapq.heappop(self.due)
+            key = entry[2]
+            if self.scheduled.get(key) is not entry:
+                continue
+            del self.scheduled[key]
+            arrivals = self.arrivals.get(key, {})
+            upcoming = [(t, trip_id) for trip_id, t in arrivals.items() if t >= now]
+            entries = self.by_stop.get(key)
+            if not upcoming or not entries:
+                continue
+            arrival, trip_id = min(upcoming)
+            eta = arrival - now
+            # Every subscriber whose threshold covers the eta fires, they sit at the end of the sorted list
+            idx = bisect_left(entries, (eta, 0))
+            for _, sub_id in entries[idx:]:
+                sub = self.subscriptions[sub_id]
+                self._notify(sub, trip_id=trip_id, route_id=key[2], stop_id=key[1], arrival=arrival, eta=int(eta))
+                self._remove(sub_id)
+            self._schedule(key, now)
+
+def start_poller(registry, fetchers, interval=30):
+    '''
+    Feed `registry` from a daemon thread. `fetchers` maps a system to a function
+    returning the trips of its current feed.
+    '''
+    def run():
+        while True:
+            for system, fetch in fetchers.items():
+                try:
+                    registry.process(system, fetch())
+                except Exception as e:
+                    print(f"Failed to match {system} subscriptions. Error:", e)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread